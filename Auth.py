@@ -2,7 +2,7 @@
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from flask import session, redirect, url_for
-from db import get_db
+from db import get_db, run_write
 import  sqlite3, uuid
 
 class User:
@@ -18,15 +18,10 @@ class User:
     @staticmethod
     def create_local(db, username, email, password):
         """Create a new local user with hashed password."""
+        hashed_pwd = generate_password_hash(password)
         try:
-            hashed_pwd = generate_password_hash(password)
-            cursor = db.cursor()
-            cursor.execute(
-                "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
-                (username, email, hashed_pwd)
-            )
-            db.commit()
-            return User(id=cursor.lastrowid, username=username, email=email)
+            user_id = run_write(User._insert, (username, email, hashed_pwd, None, None))
+            return User(id=user_id, username=username, email=email)
         except sqlite3.IntegrityError:
             return None  # User already exists
 
@@ -43,24 +38,24 @@ class User:
 
         # Create new OAuth user
         try:
-            cursor.execute(
-                "INSERT INTO users (username, email, oauth_provider, oauth_id) VALUES (?, ?, ?, ?)",
-                (username, email, oauth_provider, oauth_id)
-            )
-            db.commit()
-            return User(id=cursor.lastrowid, username=username, email=email, oauth_provider=oauth_provider,
+            user_id = run_write(User._insert, (username, email, None, oauth_provider, oauth_id))
+            return User(id=user_id, username=username, email=email, oauth_provider=oauth_provider,
                         oauth_id=oauth_id)
         except sqlite3.IntegrityError:
             # Username or email conflict; use a unique variant
             unique_username = f"{oauth_provider}_{uuid.uuid4().hex[:8]}"
-            cursor.execute(
-                "INSERT INTO users (username, email, oauth_provider, oauth_id) VALUES (?, ?, ?, ?)",
-                (unique_username, email, oauth_provider, oauth_id)
-            )
-            db.commit()
-            return User(id=cursor.lastrowid, username=unique_username, email=email, oauth_provider=oauth_provider,
+            user_id = run_write(User._insert, (unique_username, email, None, oauth_provider, oauth_id))
+            return User(id=user_id, username=unique_username, email=email, oauth_provider=oauth_provider,
                         oauth_id=oauth_id)
 
+    @staticmethod
+    def _insert(conn, values):
+        """Writer job: insert a users row, return its id."""
+        return conn.execute(
+            "INSERT INTO users (username, email, password, oauth_provider, oauth_id) VALUES (?, ?, ?, ?, ?)",
+            values
+        ).lastrowid
+
     @staticmethod
     def authenticate(db, username, password):
         """Authenticate user by username and password."""
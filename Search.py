@@ -0,0 +1,1173 @@
+import base64
+import json
+import re
+import sqlite3
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import chain
+from heapq import nlargest, nsmallest
+from html import escape
+
+from cache import LRUCache
+from db import connect, pool
+
+TERM_RE = re.compile(r"[a-z0-9]+")
+
+# term -> post ids, maintained in python on create/edit (tokenizing needs
+# python) and by trigger on delete
+POST_TERMS_SQL = """
+CREATE TABLE IF NOT EXISTS post_terms (
+    term TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    PRIMARY KEY (term, post_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_post_terms_post_id ON post_terms(post_id);
+
+CREATE TRIGGER IF NOT EXISTS trg_post_terms_post_delete
+AFTER DELETE ON posts BEGIN
+    DELETE FROM post_terms WHERE post_id = OLD.id;
+END;
+"""
+
+
+def tokenize(text):
+    """Lowercase alphanumeric terms of text, in order of appearance."""
+    return TERM_RE.findall((text or "").lower())
+
+
+def first_term(title):
+    """The keyword a post is related by: first term of its title."""
+    terms = tokenize(title)
+    return terms[0] if terms else None
+
+
+def index_post_terms(db, post_id, title, caption):
+    """(Re)index one post's terms. Caller commits.
+
+    Returns the set of terms added or removed for the post.
+    """
+    terms = set(tokenize(title)) | set(tokenize(caption))
+    old = {r[0] for r in db.execute("SELECT term FROM post_terms WHERE post_id=?", (post_id,))}
+    db.executemany(
+        "DELETE FROM post_terms WHERE term=? AND post_id=?",
+        [(t, post_id) for t in old - terms]
+    )
+    db.executemany(
+        "INSERT OR IGNORE INTO post_terms (term, post_id) VALUES (?, ?)",
+        [(t, post_id) for t in terms - old]
+    )
+    return terms ^ old
+
+
+def term_counts(db, terms):
+    """Map term -> number of posts containing it, for the given terms."""
+    terms = sorted(terms)
+    counts = dict.fromkeys(terms, 0)
+    for i in range(0, len(terms), 500):
+        chunk = terms[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        counts.update(db.execute(
+            f"SELECT term, COUNT(*) FROM post_terms WHERE term IN ({marks}) GROUP BY term",
+            chunk
+        ).fetchall())
+    return counts
+
+
+def backfill_post_terms(db, batch_size=500):
+    """Index posts that have no terms yet, committing after each batch.
+
+    Returns the number of posts indexed.
+    """
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = db.execute("""
+            SELECT id, title, caption FROM posts
+            WHERE id > ? AND NOT EXISTS (SELECT 1 FROM post_terms t WHERE t.post_id = posts.id)
+            ORDER BY id LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        for pid, title, caption in rows:
+            index_post_terms(db, pid, title, caption)
+        db.commit()
+        last_id = rows[-1][0]
+        indexed += len(rows)
+    return indexed
+
+
+def related_counts(db, posts):
+    """Map post id -> number of other posts sharing its title's first term.
+
+    One grouped query over the term index for the whole batch of posts.
+    """
+    terms = {p["id"]: first_term(p["title"]) for p in posts}
+    wanted = sorted({t for t in terms.values() if t})
+    if not wanted:
+        return {pid: 0 for pid in terms}
+
+    marks = ",".join("?" * len(wanted))
+    counts = dict(db.execute(
+        f"SELECT term, COUNT(*) FROM post_terms WHERE term IN ({marks}) GROUP BY term",
+        wanted
+    ).fetchall())
+
+    # every post contains its own first title term, so exclude itself
+    return {
+        pid: max(counts.get(t, 0) - 1, 0) if t else 0
+        for pid, t in terms.items()
+    }
+
+
+# -------------------------
+# FULL-TEXT SEARCH
+# -------------------------
+SEARCH_LIMIT = 20         # default page size
+SEARCH_MAX_LIMIT = 50     # server-side cap on limit
+
+# external-content FTS5 index over posts(title, caption), synced by triggers
+POSTS_FTS_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+    title, caption,
+    content='posts', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)
+"""
+
+# trigram index over the same columns: answers LIKE '%q%' substring searches
+# (e.g. 'ueu' inside 'Queue') without scanning every caption
+POSTS_TRGM_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_trgm USING fts5(
+    title, caption,
+    content='posts', content_rowid='id',
+    tokenize='trigram'
+)
+"""
+
+# keeps an external-content index ({name}) in step with posts
+FTS_TRIGGERS_SQL = """
+CREATE TRIGGER IF NOT EXISTS trg_{name}_insert
+AFTER INSERT ON posts BEGIN
+    INSERT INTO {name} (rowid, title, caption) VALUES (NEW.id, NEW.title, NEW.caption);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_{name}_delete
+AFTER DELETE ON posts BEGIN
+    INSERT INTO {name} ({name}, rowid, title, caption)
+    VALUES ('delete', OLD.id, OLD.title, OLD.caption);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_{name}_update
+AFTER UPDATE OF title, caption ON posts BEGIN
+    INSERT INTO {name} ({name}, rowid, title, caption)
+    VALUES ('delete', OLD.id, OLD.title, OLD.caption);
+    INSERT INTO {name} (rowid, title, caption) VALUES (NEW.id, NEW.title, NEW.caption);
+END;
+"""
+
+# snippet() markers, swapped for <mark> after the text is escaped
+_HL_START, _HL_END = "\x02", "\x03"
+SNIPPET_TOKENS = 16
+SNIPPET_CHARS = 120
+# FTS result order; title matches weigh ten times caption matches
+_FTS_RANK = "bm25(posts_fts, 10.0, 1.0)"
+
+
+def _create_fts_table(db, name, ddl, batch_size=1000):
+    """Create an external-content FTS5 table and fill it from posts.
+
+    The fill commits every batch_size posts and resumes from the last
+    indexed id, so a large posts table is indexed in bounded transactions;
+    the triggers are created once it is complete.
+    Returns False when sqlite is built without fts5 (or the tokenizer).
+    """
+    try:
+        db.execute(ddl)
+    except sqlite3.OperationalError:
+        return False
+    if _trigger_exists(db, f"trg_{name}_insert"):
+        return True
+
+    last_id = db.execute(f"SELECT COALESCE(MAX(id), 0) FROM {name}_docsize").fetchone()[0]
+    while True:
+        row = db.execute(
+            "SELECT MAX(id) FROM (SELECT id FROM posts WHERE id > ? ORDER BY id LIMIT ?)",
+            (last_id, batch_size)
+        ).fetchone()
+        if row[0] is None:
+            break
+        db.execute(f"""
+            INSERT INTO {name} (rowid, title, caption)
+            SELECT id, title, caption FROM posts WHERE id > ? AND id <= ?
+        """, (last_id, row[0]))
+        db.commit()
+        last_id = row[0]
+    db.executescript(FTS_TRIGGERS_SQL.format(name=name))
+    return True
+
+
+def _trigger_exists(db, name):
+    row = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name=?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def _table_exists(db, name):
+    row = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def create_fts(db):
+    """Create posts_fts and posts_trgm. Without them searches use LIKE scans."""
+    fts = _create_fts_table(db, "posts_fts", POSTS_FTS_SQL)
+    trigram = _create_fts_table(db, "posts_trgm", POSTS_TRGM_SQL)
+    return fts and trigram
+
+
+def has_fts(db):
+    return _table_exists(db, "posts_fts")
+
+
+def has_trigram(db):
+    return _table_exists(db, "posts_trgm")
+
+
+def fts_query(q):
+    """Turn user input into a safe FTS5 query: every term, as a prefix, ANDed."""
+    return " ".join(f'"{t}"*' for t in tokenize(q))
+
+
+def _highlight(snippet):
+    return (escape(snippet or "")
+            .replace(_HL_START, "<mark>")
+            .replace(_HL_END, "</mark>"))
+
+
+def like_snippet(text, q):
+    """Fallback snippet: escaped window of text around the first match of q."""
+    text = text or ""
+    at = text.lower().find(q.lower()) if q else -1
+    if at < 0:
+        return escape(text[:SNIPPET_CHARS]) + ("…" if len(text) > SNIPPET_CHARS else "")
+    start = max(at - SNIPPET_CHARS // 2, 0)
+    end = min(at + len(q) + SNIPPET_CHARS // 2, len(text))
+    return ("…" if start else "") + escape(text[start:at]) \
+        + "<mark>" + escape(text[at:at + len(q)]) + "</mark>" \
+        + escape(text[at + len(q):end]) + ("…" if end < len(text) else "")
+
+
+def encode_cursor(kind, *values):
+    """Opaque page cursor carrying kind and the values the next page starts after."""
+    raw = json.dumps([kind, *values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def parse_cursor(cursor, kind, size=1):
+    """The size values of a cursor made by encode_cursor(kind, ...).
+
+    Returns None for the first page; raises ValueError for a malformed
+    cursor or one issued by a different kind of search.
+    """
+    if not cursor:
+        return None
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError(f"invalid cursor: {cursor!r}") from None
+    if (not isinstance(decoded, list) or len(decoded) != size + 1 or decoded[0] != kind
+            or not all(isinstance(v, (int, float)) and not isinstance(v, bool)
+                       for v in decoded[1:])):
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    return tuple(decoded[1:])
+
+
+def clamp_limit(limit):
+    return max(1, min(int(limit or SEARCH_LIMIT), SEARCH_MAX_LIMIT))
+
+
+def search_post_rows(db, q, limit=SEARCH_LIMIT, mode="fts", cursor=None):
+    """One page of posts matching q, with latest comment and a snippet.
+
+    mode="fts" ranks term/prefix matches with bm25 through posts_fts.
+    mode="substring" keeps the exact LIKE '%q%' semantics (ordered by id
+    DESC) and uses the posts_trgm trigram index to find the candidates.
+    mode="fuzzy" tolerates typos in title and heading words (FuzzyIndex).
+    Without the index either mode runs the LIKE scan. Every path returns
+    (rows, next_cursor), rows being dicts with the same keys:
+    id, title, caption, caption_html, latest_comment, snippet.
+    next_cursor is None on the last page.
+    """
+    limit = clamp_limit(limit)
+
+    if mode == "substring":
+        return substring_post_rows(db, q, limit, cursor)
+    if mode == "fuzzy":
+        return fuzzy_post_rows(db, q, limit, cursor)
+
+    match = fts_query(q)
+    if match and has_fts(db):
+        # keyset on the (rank, id) ordering: the page after the last row shown
+        after = parse_cursor(cursor, "rank", 2)
+        keyset, params = "", [match]
+        if after:
+            keyset = f"AND ({_FTS_RANK} > ? OR ({_FTS_RANK} = ? AND p.id < ?))"
+            params.extend([after[0], after[0], after[1]])
+        params.append(limit + 1)
+        rows = db.execute(f"""
+            SELECT p.id, p.title, p.caption, p.caption_html, s.latest_comment,
+                   snippet(posts_fts, 1, '{_HL_START}', '{_HL_END}', '…', {SNIPPET_TOKENS}) AS snippet,
+                   {_FTS_RANK} AS rank
+            FROM posts_fts
+            JOIN posts p ON p.id = posts_fts.rowid
+            LEFT JOIN post_stats s ON s.post_id = p.id
+            WHERE posts_fts MATCH ? {keyset}
+            ORDER BY rank, p.id DESC
+            LIMIT ?
+        """, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor("rank", last["rank"], last["id"])
+        results = []
+        for r in rows[:limit]:
+            row = dict(r, snippet=_highlight(r["snippet"]))
+            del row["rank"]
+            results.append(row)
+        return results, next_cursor
+
+    return like_post_rows(db, q, limit, cursor)
+
+
+def like_post_rows(db, q, limit=SEARCH_LIMIT, cursor=None, candidates=None):
+    """title LIKE '%q%' OR caption LIKE '%q%', newest first, keyset-paginated.
+
+    candidates is an optional (sql, params) subquery of post ids that must
+    contain every match; the LIKE test is still applied to each candidate.
+    """
+    where = ""
+    params = []
+    if candidates is not None:
+        where += f"p.id IN ({candidates[0]}) AND "
+        params.extend(candidates[1])
+    before = parse_cursor(cursor, "id")
+    if before:
+        where += "p.id < ? AND "
+        params.append(before[0])
+    params.extend([f"%{q}%", f"%{q}%", limit + 1])
+
+    rows = db.execute(f"""
+        SELECT p.id, p.title, p.caption, p.caption_html, s.latest_comment
+        FROM posts p
+        LEFT JOIN post_stats s ON s.post_id = p.id
+        WHERE {where}(p.title LIKE ? OR p.caption LIKE ?)
+        ORDER BY p.id DESC
+        LIMIT ?
+    """, params).fetchall()
+    next_cursor = encode_cursor("id", rows[limit - 1]["id"]) if len(rows) > limit else None
+    return [dict(r, snippet=like_snippet(r["caption"], q)) for r in rows[:limit]], next_cursor
+
+
+def substring_post_rows(db, q, limit=SEARCH_LIMIT, cursor=None):
+    """Exactly the LIKE '%q%' result set, via the trigram index when it can help.
+
+    Trigrams need at least three characters, and LIKE wildcards in q (% and
+    _) have no trigram equivalent; those queries run the plain scan.
+    The trigram tokenizer folds case at least as broadly as LIKE, so its
+    matches are a superset that the LIKE re-check narrows back down.
+    """
+    if len(q) < 3 or "%" in q or "_" in q or not has_trigram(db):
+        return like_post_rows(db, q, limit, cursor)
+
+    phrase = '"' + q.replace('"', '""') + '"'
+    return like_post_rows(
+        db, q, limit, cursor,
+        candidates=("SELECT rowid FROM posts_trgm WHERE posts_trgm MATCH ?", [phrase])
+    )
+
+
+# -------------------------
+# POST CHANGE LOG
+# -------------------------
+# one row per created, retitled/re-captioned or deleted post, written by
+# triggers: every process replays it into its in-memory indexes
+POST_CHANGES_SQL = """
+CREATE TABLE IF NOT EXISTS post_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    post_id INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_post_changes_insert
+AFTER INSERT ON posts BEGIN
+    INSERT INTO post_changes (post_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_post_changes_update
+AFTER UPDATE OF title, caption ON posts BEGIN
+    INSERT INTO post_changes (post_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_post_changes_delete
+AFTER DELETE ON posts BEGIN
+    INSERT INTO post_changes (post_id) VALUES (OLD.id);
+END;
+"""
+
+# an index further behind than this is rebuilt rather than caught up
+SEARCH_REBUILD_CHANGES = 5000
+
+
+# -------------------------
+# IN-MEMORY TITLE INDEX
+# -------------------------
+TITLE_KEY_CHARS = 16        # suffixes are ordered on this many leading characters
+TITLE_MERGE_POSTS = 256     # titles staged before they are merged into the suffix array
+TITLE_OFFSET_BITS = 16      # suffix entries pack (slot << bits) | offset into one int
+TITLE_OFFSET_MASK = (1 << TITLE_OFFSET_BITS) - 1
+
+
+class TitleIndex:
+    """Process-wide index of post titles, kept current by sync_search_indexes().
+
+    Prefix lookups binary-search a sorted array of (lowercase title, post
+    id). Substring lookups binary-search a suffix array ordered on the
+    first TITLE_KEY_CHARS characters of each suffix; longer queries
+    re-check the full suffix. The suffix array is built on the first
+    substring lookup, not with the rest of the index, and holds one
+    packed 64-bit int per title character: the title's slot in _slots
+    and the suffix's offset into it.
+
+    New titles are staged and scanned directly until TITLE_MERGE_POSTS of
+    them have gathered, then merged into the suffix array in one pass.
+    Entries of removed or retitled posts are skipped until a quarter of
+    the array is stale, when it is dropped and rebuilt on next use.
+    """
+
+    def __init__(self):
+        self._titles = {}       # post id -> title
+        self._keys = {}         # post id -> title.lower()
+        self._sorted = []       # (title.lower(), post id)
+        self._suffixes = None   # packed suffix entries, ordered by _suffix_key; None until used
+        self._slots = []        # slot -> title.lower() the entries were built from
+        self._slot_pids = array("q")    # slot -> post id
+        self._slot_of = {}      # post id -> its live slot
+        self._staged = {}       # post id -> title.lower(), not yet in _suffixes
+        self._stale = 0         # _suffixes entries of removed or retitled posts
+        self._lock = threading.RLock()
+
+    def _suffix_key(self, entry):
+        offset = entry & TITLE_OFFSET_MASK
+        return self._slots[entry >> TITLE_OFFSET_BITS][offset:offset + TITLE_KEY_CHARS]
+
+    def _new_slot(self, pid, key):
+        """Give key a slot; the base its packed suffix entries are offsets from."""
+        slot = len(self._slots)
+        self._slots.append(key)
+        self._slot_pids.append(pid)
+        self._slot_of[pid] = slot
+        return slot << TITLE_OFFSET_BITS
+
+    def build(self, rows):
+        """Replace the contents with (post id, title) rows."""
+        with self._lock:
+            self._titles = {pid: title or "" for pid, title in rows}
+            self._keys = {pid: title.lower() for pid, title in self._titles.items()}
+            self._sorted = sorted((key, pid) for pid, key in self._keys.items())
+            self._suffixes = None
+            self._staged = {}
+
+    def _build_suffixes(self):
+        self._slots, self._slot_pids, self._slot_of = [], array("q"), {}
+        # bucketed on the leading character, packed, and sorted one bucket
+        # at a time, which bounds the number of sort keys alive at once
+        buckets = {}
+        for pid, key in self._keys.items():
+            base = self._new_slot(pid, key)
+            for i, ch in enumerate(key[:TITLE_OFFSET_MASK + 1]):
+                bucket = buckets.get(ch)
+                if bucket is None:
+                    bucket = buckets[ch] = array("q")
+                bucket.append(base | i)
+        slots = self._slots
+
+        def suffix_key(entry):
+            offset = entry & TITLE_OFFSET_MASK
+            return slots[entry >> TITLE_OFFSET_BITS][offset:offset + TITLE_KEY_CHARS]
+
+        self._suffixes = array("q")
+        for ch in sorted(buckets):
+            self._suffixes.extend(sorted(buckets.pop(ch), key=suffix_key))
+        self._staged = {}
+        self._stale = 0
+
+    def add(self, post_id, title):
+        """Insert or replace a post's title."""
+        with self._lock:
+            self.remove(post_id)
+            title = title or ""
+            key = title.lower()
+            self._titles[post_id] = title
+            self._keys[post_id] = key
+            insort(self._sorted, (key, post_id))
+            if self._suffixes is None:
+                return
+            self._staged[post_id] = key
+            if len(self._staged) >= TITLE_MERGE_POSTS:
+                self._merge()
+
+    def remove(self, post_id):
+        with self._lock:
+            self._titles.pop(post_id, None)
+            key = self._keys.pop(post_id, None)
+            if key is None:
+                return
+            self._delete(self._sorted, (key, post_id))
+            if self._suffixes is None or self._staged.pop(post_id, None) is not None:
+                return
+            if self._slot_of.pop(post_id, None) is not None:
+                self._stale += len(key)
+                if self._stale > len(self._suffixes) // 4:
+                    self._suffixes = None
+
+    def _merge(self):
+        """Move the staged titles into the suffix array."""
+        staged = []
+        for pid, key in self._staged.items():
+            base = self._new_slot(pid, key)
+            staged.extend(base | i for i in range(min(len(key), TITLE_OFFSET_MASK + 1)))
+        staged.sort(key=self._suffix_key)
+        suffixes = self._suffixes
+        merged, start = array("q"), 0
+        for entry in staged:
+            at = bisect_left(suffixes, self._suffix_key(entry), lo=start, key=self._suffix_key)
+            merged.extend(suffixes[start:at])
+            merged.append(entry)
+            start = at
+        merged.extend(suffixes[start:])
+        self._suffixes = merged
+        self._staged = {}
+
+    @staticmethod
+    def _delete(arr, item):
+        i = bisect_left(arr, item)
+        if i < len(arr) and arr[i] == item:
+            del arr[i]
+
+    @staticmethod
+    def _scan(arr, text):
+        """Entries of a sorted (key, id) array whose key starts with text."""
+        i = bisect_left(arr, (text,))
+        while i < len(arr) and arr[i][0].startswith(text):
+            yield arr[i]
+            i += 1
+
+    def _containing(self, text):
+        """Ids of posts whose lowercase title contains text."""
+        if self._suffixes is None:
+            self._build_suffixes()
+        head = text[:TITLE_KEY_CHARS]
+        suffixes, slots, pids, live = self._suffixes, self._slots, self._slot_pids, self._slot_of
+        ids = set()
+        i = bisect_left(suffixes, head, key=self._suffix_key)
+        while i < len(suffixes):
+            slot, offset = suffixes[i] >> TITLE_OFFSET_BITS, suffixes[i] & TITLE_OFFSET_MASK
+            key = slots[slot]
+            if not key.startswith(head, offset):
+                break
+            if live.get(pids[slot]) == slot and key.startswith(text, offset):
+                ids.add(pids[slot])
+            i += 1
+        ids.update(pid for pid, key in self._staged.items() if text in key)
+        return ids
+
+    def prefix(self, text, limit=None):
+        """(post id, title) for titles starting with text, in title order."""
+        out = []
+        with self._lock:
+            for _, pid in self._scan(self._sorted, (text or "").lower()):
+                out.append((pid, self._titles[pid]))
+                if limit and len(out) >= limit:
+                    break
+        return out
+
+    def search(self, text, limit=None):
+        """(post id, title) for titles containing text, in title order."""
+        text = (text or "").lower()
+        if not text:
+            return []
+        with self._lock:
+            hits = sorted((self._keys[pid], pid) for pid in self._containing(text))
+            return [(pid, self._titles[pid]) for _, pid in hits[:limit]]
+
+    def __len__(self):
+        return len(self._titles)
+
+
+title_index = TitleIndex()
+
+
+# -------------------------
+# FUZZY (TYPO-TOLERANT) SEARCH
+# -------------------------
+FUZZY_MIN_TERM_LEN = 3
+FUZZY_MAX_DISTANCE = 2
+HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s+(.*)$", re.MULTILINE)
+
+
+def fuzzy_terms(title, caption):
+    """Words indexed for fuzzy search: the title plus markdown headings."""
+    text = " ".join([title or ""] + HEADING_RE.findall(caption or ""))
+    return {t for t in tokenize(text) if len(t) >= FUZZY_MIN_TERM_LEN}
+
+
+def fuzzy_distance(term):
+    """Default edit budget: exact for short words, up to 2 for longer ones."""
+    if len(term) < 3:
+        return 0
+    return 1 if len(term) < 5 else FUZZY_MAX_DISTANCE
+
+
+def levenshtein(a, b):
+    """Edit distance, bit-parallel over a (Hyyrö's variant of Myers' algorithm)."""
+    return _Matcher(a)(b)
+
+
+class _Matcher:
+    """Precomputed pattern bitmasks for repeated levenshtein(pattern, x)."""
+
+    def __init__(self, pattern):
+        self.m = len(pattern)
+        self.last = 1 << (self.m - 1) if self.m else 0
+        self.mask = (1 << self.m) - 1
+        self.peq = {}
+        for i, ch in enumerate(pattern):
+            self.peq[ch] = self.peq.get(ch, 0) | (1 << i)
+
+    def __call__(self, text):
+        if not self.m:
+            return len(text)
+        mask, last, peq = self.mask, self.last, self.peq
+        pv, mv, score = mask, 0, self.m
+        for ch in text:
+            eq = peq.get(ch, 0)
+            xv = eq | mv
+            xh = (((eq & pv) + pv) ^ pv) | eq
+            ph = mv | (~(xh | pv) & mask)
+            mh = pv & xh
+            if ph & last:
+                score += 1
+            elif mh & last:
+                score -= 1
+            ph = ((ph << 1) | 1) & mask
+            mh = (mh << 1) & mask
+            pv = mh | (~(xv | ph) & mask)
+            mv = ph & xv
+        return score
+
+
+def word_bigrams(word):
+    """Bigrams of "$word$", repeats numbered so shared counts are multiset counts."""
+    padded = f"${word}$"
+    seen = {}
+    out = []
+    for i in range(len(padded) - 1):
+        g = padded[i:i + 2]
+        n = seen.get(g, 0)
+        seen[g] = n + 1
+        out.append(g if not n else f"{g}{n}")
+    return out
+
+
+class GramWords:
+    """Vocabulary searchable by edit distance through a bigram filter.
+
+    One edit destroys at most two bigrams of the padded word, so a word
+    within distance k of term shares at least len(term) + 1 - 2k of them;
+    only words meeting that count (and within k in length) get the exact
+    distance check. Budgets too large for the bound scan the vocabulary.
+    Words are never removed; callers treat words with no remaining
+    postings as tombstones.
+    """
+
+    def __init__(self):
+        self._grams = {}    # bigram -> words
+        self._words = set()
+
+    def add(self, word):
+        if word in self._words:
+            return
+        self._words.add(word)
+        for g in word_bigrams(word):
+            self._grams.setdefault(g, []).append(word)
+
+    def search(self, term, k):
+        """(distance, word) for every word within distance k of term."""
+        need = len(term) + 1 - 2 * k
+        if need < 1:
+            candidates = self._words
+        else:
+            counts = Counter(chain.from_iterable(
+                self._grams.get(g, ()) for g in word_bigrams(term)
+            ))
+            candidates = [w for w, n in counts.items() if n >= need]
+
+        lo, hi = len(term) - k, len(term) + k
+        dist = _Matcher(term)
+        hits = ((dist(w), w) for w in candidates if lo <= len(w) <= hi)
+        return [(d, w) for d, w in hits if d <= k]
+
+    def __len__(self):
+        return len(self._words)
+
+
+class FuzzyIndex:
+    """Typo-tolerant index of title and heading words, kept current by
+    sync_search_indexes().
+
+    GramWords finds the indexed words near each query word; postings
+    map those words back to posts. Posts are ranked by how many query words
+    they match, then by total edit distance, then newest first.
+    """
+
+    def __init__(self):
+        self._vocab = GramWords()
+        self._postings = {}     # word -> post ids
+        self._words = {}        # post id -> tuple of words
+        self._lock = threading.RLock()
+
+    def build(self, rows):
+        """Replace the contents with (post id, title, caption) rows."""
+        with self._lock:
+            self._vocab = GramWords()
+            self._postings = {}
+            self._words = {}
+            for pid, title, caption in rows:
+                self.add(pid, title, caption)
+
+    def add(self, post_id, title, caption):
+        """Insert or replace a post's words."""
+        with self._lock:
+            self.remove(post_id)
+            words = self._words[post_id] = tuple(fuzzy_terms(title, caption))
+            for w in words:
+                ids = self._postings.get(w)
+                if ids is None:
+                    ids = self._postings[w] = set()
+                    self._vocab.add(w)
+                ids.add(post_id)
+
+    def remove(self, post_id):
+        with self._lock:
+            for w in self._words.pop(post_id, ()):
+                self._postings[w].discard(post_id)
+
+    def search(self, q, k=None, stop=None):
+        """Rank posts near any word of q.
+
+        Returns (the best `stop` post ids in order (all if stop is None),
+        number of matching posts, {matched word: distance}).
+        """
+        near = {}
+        per_term = []   # per query word: [(distance, post ids)], nearest first
+        with self._lock:
+            for term in dict.fromkeys(tokenize(q)):
+                budget = fuzzy_distance(term) if k is None else k
+                by_distance = {}
+                for d, w in self._vocab.search(term, budget):
+                    by_distance.setdefault(d, []).append(w)
+                    near[w] = min(d, near.get(w, d))
+                rings, seen = [], set()
+                for d in sorted(by_distance):
+                    ids = set().union(*(self._postings[w] for w in by_distance[d])) - seen
+                    rings.append((d, ids))
+                    seen |= ids
+                per_term.append(rings)
+
+        if len(per_term) == 1:
+            # rank is just the distance: each ring newest first
+            total = sum(len(ids) for _, ids in per_term[0])
+            ranked = []
+            for _, ids in per_term[0]:
+                ranked.extend(_top(ids, None if stop is None else stop - len(ranked)))
+            return ranked, total, near
+
+        # query words matched and total distance per post, counted in C
+        matched = Counter(chain.from_iterable(
+            ids for rings in per_term for _, ids in rings))
+        distance = Counter(chain.from_iterable(
+            ids for rings in per_term for d, ids in rings for _ in range(d)))
+
+        # most query words matched, then least total distance, then newest
+        def rank(pid):
+            return -matched[pid], distance[pid], -pid
+
+        if stop is None:
+            ranked = sorted(matched, key=rank)
+        else:
+            ranked = nsmallest(stop, matched, key=rank)
+        return ranked, len(matched), near
+
+    def best_word(self, post_id, near):
+        """The post's word closest to the query, from search()'s near map."""
+        words = [w for w in self._words.get(post_id, ()) if w in near]
+        return min(words, key=lambda w: (near[w], w)) if words else ""
+
+    @property
+    def vocabulary_size(self):
+        return len(self._vocab)
+
+    def __len__(self):
+        return len(self._words)
+
+
+def _top(values, n=None):
+    """The n largest values, largest first (all of them if n is None)."""
+    if n is None:
+        return sorted(values, reverse=True)
+    return nlargest(n, values) if n > 0 else []
+
+
+fuzzy_index = FuzzyIndex()
+
+
+def fuzzy_post_rows(db, q, limit=SEARCH_LIMIT, cursor=None):
+    """Typo-tolerant search over titles and headings, ranked, offset-paginated."""
+    sync_search_indexes(db)
+    start = parse_cursor(cursor, "offset")
+    if start and (not isinstance(start[0], int) or start[0] < 0):
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    offset = start[0] if start else 0
+    ranked, total, near = fuzzy_index.search(q, stop=offset + limit)
+    page = ranked[offset:]
+    next_cursor = encode_cursor("offset", offset + limit) if total > offset + limit else None
+    if not page:
+        return [], next_cursor
+
+    rows = db.execute(f"""
+        SELECT p.id, p.title, p.caption, p.caption_html, s.latest_comment
+        FROM posts p
+        LEFT JOIN post_stats s ON s.post_id = p.id
+        WHERE p.id IN ({",".join("?" * len(page))})
+    """, page).fetchall()
+    by_id = {r["id"]: r for r in rows}
+    return [dict(by_id[pid], snippet=like_snippet(by_id[pid]["caption"],
+                                                   fuzzy_index.best_word(pid, near)))
+            for pid in page if pid in by_id], next_cursor
+
+
+# -------------------------
+# SUGGESTIONS
+# -------------------------
+SUGGEST_LIMIT = 8
+SUGGEST_MIN_DF = 2        # a caption term must appear in this many posts
+SUGGEST_MIN_TERM_LEN = 3
+
+
+class _TrieNode:
+    __slots__ = ("children", "weight", "word", "best")
+
+    def __init__(self):
+        self.children = {}
+        self.weight = 0
+        self.word = None
+        self.best = []        # top (-weight, word) pairs in this subtree
+
+
+class TermTrie:
+    """Prefix trie of weighted terms with the top-k kept at every node.
+
+    set() refreshes the cached top-k on the path it touched, so a
+    completion is a walk down len(prefix) nodes plus a copy of k items.
+    """
+
+    def __init__(self, k=SUGGEST_LIMIT):
+        self.k = k
+        self.root = _TrieNode()
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def build(self, items):
+        """Replace every term with the (word, weight) pairs in items.
+
+        The new trie is filled off to the side and swapped in, so
+        completions keep answering from the old one meanwhile.
+        """
+        fresh = TermTrie(self.k)
+        for word, weight in items:
+            fresh.set(word, weight)
+        with self._lock:
+            self.root = fresh.root
+            self.loaded = True
+
+    def set(self, word, weight):
+        """Insert word with weight, or remove it when weight <= 0."""
+        with self._lock:
+            path = [self.root]
+            node = self.root
+            for ch in word:
+                node = node.children.setdefault(ch, _TrieNode())
+                path.append(node)
+            node.weight = max(weight, 0)
+            node.word = word if node.weight else None
+
+            for i in range(len(path) - 1, -1, -1):
+                n = path[i]
+                best = [(-n.weight, n.word)] if n.word else []
+                for child in n.children.values():
+                    best.extend(child.best)
+                n.best = sorted(best)[:self.k]
+                # prune branches that no longer hold any word
+                if i and not n.best and not n.children:
+                    del path[i - 1].children[word[i - 1]]
+
+    def complete(self, prefix, k=None):
+        """Up to k (word, weight) completions of prefix, heaviest first."""
+        node = self.root
+        with self._lock:
+            for ch in prefix:
+                node = node.children.get(ch)
+                if node is None:
+                    return []
+            return [(w, -neg) for neg, w in node.best[:k or self.k]]
+
+
+def suggestable(term):
+    return len(term) >= SUGGEST_MIN_TERM_LEN and not term.isdigit()
+
+
+term_trie = TermTrie()
+
+
+def load_term_trie(db):
+    """Fill term_trie with the frequent terms from post_terms."""
+    term_trie.build(
+        (term, df) for term, df in db.execute(
+            "SELECT term, COUNT(*) FROM post_terms GROUP BY term HAVING COUNT(*) >= ?",
+            (SUGGEST_MIN_DF,))
+        if suggestable(term))
+
+
+def update_term_trie(db, terms):
+    """Re-weigh terms whose document frequency may have changed."""
+    if not term_trie.loaded or not terms:
+        return
+    for term, df in term_counts(db, [t for t in terms if suggestable(t)]).items():
+        term_trie.set(term, df if df >= SUGGEST_MIN_DF else 0)
+
+
+# Terms a post loses in another process cannot be re-weighed from the log
+# (post_terms no longer lists them), so term_trie is reloaded after this
+# many logged changes to bound how long such a term keeps its old weight.
+TERM_TRIE_RELOAD_CHANGES = 1000
+
+# only captions with a heading in them are read; the rest index no words
+_HEADING_CAPTION = "CASE WHEN instr(caption, '#') THEN caption END"
+
+_sync_lock = threading.Lock()
+_synced_seq = None      # last post_changes seq applied to the in-memory indexes
+_trie_seq = None        # post_changes seq term_trie was last loaded at
+
+
+def _apply_post_changes(db, since, head):
+    """Re-read the posts logged in (since, head] into the in-memory indexes."""
+    changed = [r[0] for r in db.execute(
+        "SELECT DISTINCT post_id FROM post_changes WHERE seq > ? AND seq <= ?", (since, head))]
+    terms = set()
+    for i in range(0, len(changed), 500):
+        chunk = changed[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        rows = {r[0]: r for r in db.execute(
+            f"SELECT id, title, {_HEADING_CAPTION} FROM posts WHERE id IN ({marks})", chunk)}
+        for pid in chunk:
+            if pid in rows:
+                title_index.add(pid, rows[pid][1])
+                fuzzy_index.add(pid, rows[pid][1], rows[pid][2])
+            else:
+                title_index.remove(pid)
+                fuzzy_index.remove(pid)
+        terms.update(r[0] for r in db.execute(
+            f"SELECT DISTINCT term FROM post_terms WHERE post_id IN ({marks})", chunk))
+    update_term_trie(db, terms)
+
+
+def sync_search_indexes(db):
+    """Bring the in-memory title, fuzzy and suggestion indexes up to date.
+
+    The first call builds them; later calls replay the post_changes logged
+    since, whichever process made them. A call with nothing new costs one
+    read of the log's last seq. A process too far behind (or whose place
+    in the log was pruned) rebuilds instead.
+    """
+    global _synced_seq, _trie_seq
+    head = db.execute("SELECT COALESCE(MAX(seq), 0) FROM post_changes").fetchone()[0]
+    if head == _synced_seq:
+        return
+    with _sync_lock:
+        since = _synced_seq
+        if head == since:
+            return
+        oldest = db.execute("SELECT MIN(seq) FROM post_changes").fetchone()[0]
+        if (since is None or head < since or head - since > SEARCH_REBUILD_CHANGES
+                or (oldest is not None and oldest > since + 1)):
+            title_index.build(db.execute("SELECT id, title FROM posts"))
+            fuzzy_index.build(db.execute(f"SELECT id, title, {_HEADING_CAPTION} FROM posts"))
+            _trie_seq = None
+        else:
+            _apply_post_changes(db, since, head)
+        if _trie_seq is None or not 0 <= head - _trie_seq <= TERM_TRIE_RELOAD_CHANGES:
+            load_term_trie(db)
+            _trie_seq = head
+        _synced_seq = head
+
+
+def warm_search_indexes():
+    """Build the in-memory search indexes on a background thread.
+
+    Called once per process at startup, so the first suggest() or fuzzy
+    search does not pay for the build.
+    """
+    def run():
+        try:
+            sync_search_indexes(connect(readonly=True))
+        finally:
+            pool.close_thread()
+
+    threading.Thread(target=run, name="search-warm", daemon=True).start()
+
+
+def suggest(db, q, k=SUGGEST_LIMIT):
+    """Titles starting with q, then frequent caption terms completing its last word."""
+    q = (q or "").strip()
+    if not q:
+        return []
+    sync_search_indexes(db)
+
+    out = [{"text": title, "kind": "title", "id": pid}
+           for pid, title in title_index.prefix(q, k)]
+    words = tokenize(q)
+    if len(out) < k and words and q[-1].isalnum():
+        head = q[:len(q) - len(words[-1])]
+        seen = {o["text"].lower() for o in out}
+        for term, _ in term_trie.complete(words[-1], k):
+            text = head + term
+            if text.lower() not in seen:
+                out.append({"text": text, "kind": "term"})
+            if len(out) >= k:
+                break
+    return out
+
+
+# -------------------------
+# SEARCH RESULT CACHE
+# -------------------------
+# (search version, plan, normalized query, limit, cursor) -> (rows, next cursor).
+# Every write to what search rows show (a post's title or caption, a post
+# created or deleted, a comment), from any process, bumps the search
+# version, so entries never outlive the data they were read from. Votes
+# and attachments leave it alone.
+search_cache = LRUCache(max_entries=512)
+_cache_version = None
+
+SEARCH_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS search_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO search_version (id, version) VALUES (1, 0);
+"""
+
+SEARCH_VERSION_EVENTS = (
+    ("posts", "insert", "INSERT"),
+    ("posts", "update", "UPDATE OF title, caption, caption_html"),
+    ("posts", "delete", "DELETE"),
+    ("comments", "insert", "INSERT"),
+    ("comments", "update", "UPDATE OF comment"),
+    ("comments", "delete", "DELETE"),
+)
+
+SEARCH_VERSION_TRIGGER_SQL = """
+CREATE TRIGGER IF NOT EXISTS trg_search_version_{table}_{name}
+AFTER {event} ON {table} BEGIN
+    UPDATE search_version SET version = version + 1 WHERE id = 1;
+END;
+"""
+
+
+def create_search_version(conn):
+    conn.executescript(SEARCH_VERSION_SQL)
+    for table, name, event in SEARCH_VERSION_EVENTS:
+        conn.executescript(SEARCH_VERSION_TRIGGER_SQL.format(table=table, name=name, event=event))
+
+
+def get_search_version(db):
+    """The version search_cache entries are keyed on (see SEARCH_VERSION_SQL)."""
+    row = db.execute("SELECT version FROM search_version WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def search_cache_key(db, q, mode="fts"):
+    """Normalize q to the form the search actually runs.
+
+    FTS searches are keyed by their term query; LIKE and substring
+    searches (identical result sets) by q with ASCII letters lowercased,
+    which is exactly the case folding LIKE applies.
+    """
+    if mode == "fuzzy":
+        return ("fuzzy", " ".join(tokenize(q)))
+    if mode != "substring":
+        match = fts_query(q)
+        if match and has_fts(db):
+            return ("fts", match)
+    return ("like", q.translate(_ASCII_LOWER))
+
+
+def cached_search_rows(db, q, mode="fts", limit=SEARCH_LIMIT, cursor=None, fresh=False):
+    """search_post_rows() through search_cache. Callers must not mutate rows.
+
+    Returns (rows, next_cursor, hit): search_post_rows()'s pair and whether
+    it came from the cache. fresh=True skips the lookup (the result is
+    still stored).
+    """
+    global _cache_version
+    version = get_search_version(db)
+    if version != _cache_version:
+        # entries from older versions can never be hit again
+        search_cache.discard_where(lambda key, _: key[0] != version)
+        _cache_version = version
+    key = (version,) + search_cache_key(db, q, mode) + (clamp_limit(limit), cursor or "")
+    entry = None if fresh else search_cache.get(key)
+    if entry is not None:
+        return entry + (True,)
+    entry = search_post_rows(db, q, limit, mode, cursor)
+    search_cache.set(key, entry)
+    return entry + (False,)
+
+
+# -------------------------
+# WRITE HOOKS
+# -------------------------
+def post_saved(db, post_id, title, caption, changed_terms=()):
+    """Re-weigh this process's suggestions after a post is created or edited.
+
+    changed_terms is what index_post_terms() returned for the post. The
+    title and fuzzy indexes pick the post up from post_changes, and
+    search_cache entries are keyed on the search version.
+    """
+    update_term_trie(db, changed_terms)
+
+
+def post_deleted(post_id, db=None, terms=()):
+    """Re-weigh this process's suggestions after a post is deleted.
+
+    terms are the post's indexed terms, read before the delete.
+    """
+    if db is not None:
+        update_term_trie(db, terms)
@@ -9,7 +9,6 @@ bt_roots = []
 graph_vertices = []
 graph_edges = {}
 edge_weights = {}
-pending_deletes = {}
 pending_subtrees = {}
 
 class TreeNode:
@@ -1,49 +1,64 @@
 # stdlib
+import json
 import os
+import shutil
 import sqlite3
-import threading
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import wraps
 
 # flask
 from flask import (
-    Flask, request, render_template,
-    redirect, url_for, g, jsonify, session, Blueprint
+    Flask, request, render_template, stream_template, make_response,
+    redirect, url_for, jsonify, session, Blueprint
 )
 
 # content
-import markdown
-import bleach
+import click
 
 from StackQueue import *
 from Graph import *
 from TreeBTBST import *
 from Sorting import *
 from Auth import *
-from db import get_db
+from Search import *
+from db import DATABASE, get_db, get_data_version, connect, release_db, pool, run_write
+from cache import LRUCache
+from captions import caption_hash, md_to_safe_html, render_caption
+from migrations import migrate, schema_version, LATEST_VERSION
+from queryplans import check_query_plans
+from votes import vote_counter
+from scheduler import scheduler
+from state import shared_state
+from bench import bench_fuzzy_command, bench_votes_command
+import bulk
+from bulk import export_jsonl, import_jsonl, open_jsonl
+from loadtest import (HttpDriver, ROUTE_MIX, TestClientDriver, generate_dataset, git_revision,
+                      run_load, start_gunicorn)
+from maintenance import (backup, checkpoint, convert_auto_vacuum, health, maybe_checkpoint,
+                         register_maintenance, remove_files, run_maintenance, start_maintenance)
 
 app = Flask(__name__)
 app.secret_key = "visual-sorting"
-DATABASE = os.environ.get("DATABASE_PATH", "feed.db")
+# stream /lectures so the header and first posts arrive before the rest is built
+app.config.setdefault("STREAM_LECTURES", True)
 
 ALLOWED_TAGS = [
     "h1","h2","h3","p","strong","em",
     "ul","li","hr","code","pre","blockquote"
 ]
 
-def md_to_safe_html(md_text: str) -> str:
-    return bleach.clean(
-        markdown.markdown(
-            md_text or "",
-            extensions=["fenced_code", "tables"]
-        ),
-        tags=[
-            "h1","h2","h3",
-            "p","strong","em",
-            "ul","ol","li",
-            "hr",
-            "code","pre","blockquote"
-        ],
-        strip=True
-    )
+
+def cached_caption_html(row) -> str:
+    """Stored caption HTML for a posts row; never renders Markdown.
+
+    Rows that have not been backfilled yet fall back to the escaped source.
+    """
+    if row["caption_html"] is not None:
+        return row["caption_html"]
+    return escape_text(row["caption"] or "")
 
 
 import random
@@ -55,181 +70,508 @@ MAX_VALUE = 95
 def random_array():
     return [random.randint(MIN_VALUE, MAX_VALUE) for _ in range(ARRAY_SIZE)]
 
-@app.teardown_appcontext
-def close_db(error=None):
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+app.teardown_appcontext(release_db)
+
+
+@app.errorhandler(sqlite3.OperationalError)
+def database_busy(e):
+    """A write gave up waiting for another process's lock: fail fast with 503."""
+    if "locked" in str(e) or "busy" in str(e):
+        return jsonify({"ok": False, "error": "database_busy"}), 503
+    raise e
 
 def init_db():
-    dir_name = os.path.dirname(DATABASE)
-    if dir_name:  # only create folder if there is a directory
-        os.makedirs(dir_name, exist_ok=True)
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-
-    # PRAGMAS
-    cur.execute("PRAGMA journal_mode=WAL;")
-    cur.execute("PRAGMA foreign_keys=ON;")
-
-    # -------------------------
-    # BASE SCHEMA
-    # -------------------------
-    if os.path.exists("schema.sql"):
-        with open("schema.sql") as f:
-            cur.executescript(f.read())
+    """Bring the database schema up to date (see migrations.py).
+
+    Returns the migration versions applied; a current database costs one
+    PRAGMA user_version read.
+    """
+    return migrate(connect())
+
+
+def backfill_captions(db_path=None, workers=None, batch_size=200):
+    """Render caption_html for posts whose cached HTML is missing or stale.
+
+    Rendering is spread over a process pool; rows are read and written in
+    batches so memory stays bounded on large databases.
+    Returns the number of rows updated.
+    """
+    conn = connect(db_path)
+    updated = 0
+    last_id = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            rows = conn.execute(
+                "SELECT id, caption, caption_hash FROM posts WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            stale = [(pid, caption or "") for pid, caption, h in rows
+                     if h != caption_hash(caption)]
+            if not stale:
+                continue
+
+            html = pool.map(md_to_safe_html, [c for _, c in stale], chunksize=8)
+            conn.executemany(
+                "UPDATE posts SET caption_html=?, caption_hash=? WHERE id=?",
+                [(h, caption_hash(c), pid) for (pid, c), h in zip(stale, html)]
+            )
+            conn.commit()
+            updated += len(stale)
+    return updated
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations."""
+    conn = connect()
+    before = schema_version(conn)
+    applied = init_db()
+    if applied:
+        click.echo(f"Migrated schema {before} -> {applied[-1]} ({len(applied)} step(s)).")
     else:
-        # Fallback minimal schema
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE,
-            password TEXT,
-            oauth_provider TEXT,
-            oauth_id TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            title TEXT NOT NULL,
-            caption TEXT NOT NULL,
-            post_type TEXT NOT NULL DEFAULT 'text',
-            up INTEGER NOT NULL DEFAULT 0,
-            down INTEGER NOT NULL DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        );
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            post_id INTEGER NOT NULL,
-            user_id INTEGER,
-            comment TEXT NOT NULL,
-            parent_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (post_id) REFERENCES posts(id),
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        );
-        """)
-
-    # -------------------------
-    # MIGRATIONS
-    # -------------------------
-
-    # comments.parent_id
-    cur.execute("PRAGMA table_info(comments)")
-    cols = [r[1] for r in cur.fetchall()]
-    if "parent_id" not in cols:
-        try:
-            cur.execute("ALTER TABLE comments ADD COLUMN parent_id INTEGER")
-        except Exception:
-            pass
-
-    # attachments
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS attachments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        post_id INTEGER NOT NULL,
-        filename TEXT NOT NULL,
-        path TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY(post_id) REFERENCES posts(id) ON DELETE CASCADE
-    );
-    """)
-
-    # posts.user_id
-    cur.execute("PRAGMA table_info(posts)")
-    post_cols = [r[1] for r in cur.fetchall()]
-    if "user_id" not in post_cols:
+        click.echo(f"Schema is current (version {before}, latest {LATEST_VERSION}).")
+
+
+@app.cli.command("check-plans")
+def check_plans_command():
+    """EXPLAIN every SQL statement in the app; fail on unexpected full scans."""
+    checked, problems = check_query_plans(connect(readonly=True))
+    for where, sql, detail in problems:
+        click.echo(f"{where}: {detail}")
+        if sql:
+            click.echo(f"    {sql}")
+    click.echo(f"{checked} statement(s) planned, {len(problems)} problem(s).")
+    if problems:
+        raise SystemExit(1)
+
+
+@app.cli.command("maintenance")
+@click.option("--analyze", is_flag=True, help="Also run a full ANALYZE.")
+@click.option("--convert-vacuum", is_flag=True,
+              help="Only switch the database to auto_vacuum=INCREMENTAL. Runs a full VACUUM: "
+                   "rewrites the whole file, blocks every writer until done and needs free "
+                   "disk space about the database's size. Run it in a quiet window.")
+def maintenance_command(analyze, convert_vacuum):
+    """Delete orphaned rows and files, vacuum free pages, refresh statistics."""
+    if convert_vacuum:
+        start = time.perf_counter()
+        if convert_auto_vacuum():
+            click.echo(f"Converted to auto_vacuum=incremental in {time.perf_counter() - start:.1f}s.")
+        else:
+            click.echo("Already auto_vacuum=incremental.")
+        return
+    report = run_maintenance(analyze=analyze)
+    click.echo(f"Deleted {report['comments']} orphaned comment(s), {report['attachments']} "
+               f"attachment row(s) and {report['files']} file(s) ({report['file_bytes']} bytes); "
+               f"pruned {report['post_changes']} change log row(s).")
+    click.echo(f"Vacuumed {report['pages']} page(s) ({report['page_bytes']} bytes) "
+               f"in {report['seconds']:.2f}s{'; analyzed' if analyze else ''}.")
+
+
+@app.cli.command("db-maint")
+@click.option("--checkpoint", "mode", type=click.Choice(["auto", "passive", "truncate"]),
+              default=None, help="Checkpoint the WAL (auto: only past the size thresholds).")
+@click.option("--backup", "backup_path", type=click.Path(dir_okay=False), default=None,
+              help="Write an online backup of the database to this file.")
+@click.option("--quick", is_flag=True, help="Skip the per-page fragmentation scan.")
+def db_maint_command(mode, backup_path, quick):
+    """Report database/WAL health; optionally checkpoint or back up."""
+    if mode == "auto":
+        click.echo(f"Checkpoint: {maybe_checkpoint() or 'not needed'}.")
+    elif mode:
+        busy, frames, done = checkpoint(mode)
+        click.echo(f"Checkpoint {mode.upper()}: {done}/{frames} frame(s) copied"
+                   f"{' (blocked by a reader)' if busy else ''}.")
+    if backup_path:
+        start = time.perf_counter()
+        pages = backup(backup_path)
+        click.echo(f"Backed up {pages} page(s) to {backup_path} in {time.perf_counter() - start:.2f}s.")
+
+    h = health(detailed=not quick)
+    click.echo(f"Database: {h['db_bytes']} bytes, {h['page_count']} pages of {h['page_size']} bytes, "
+               f"auto_vacuum={h['auto_vacuum']}")
+    click.echo(f"WAL: {h['wal_bytes']} bytes")
+    click.echo(f"Free pages: {h['freelist_count']} ({h['free_pct']}%)")
+    if h["unused_pct"] is not None:
+        click.echo(f"Unused space in allocated pages: {h['unused_pct']}%")
+
+
+@app.cli.command("export")
+@click.argument("path", default="-")
+def export_command(path):
+    """Stream posts, comments and attachments to a JSONL file ('-' for stdout)."""
+    start = time.perf_counter()
+    out = open_jsonl(path, "w")
+    try:
+        rows = export_jsonl(connect(readonly=True), out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    click.echo(f"Exported {rows} row(s) in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s).", err=True)
+
+
+@app.cli.command("import")
+@click.argument("path", default="-")
+def import_command(path):
+    """Load a JSONL export ('-' for stdin), committing in batches.
+
+    Reports two rates: staging (parse, tokenize, insert into temp tables)
+    and publishing (copying the rows in with post_terms, stats and FTS).
+    """
+    init_db()
+    start = time.perf_counter()
+    source = open_jsonl(path, "r")
+    try:
+        rows = import_jsonl(connect(), source)
+    except (ValueError, sqlite3.IntegrityError) as e:
+        raise click.ClickException(f"import failed: {e}")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    elapsed = time.perf_counter() - start
+    timings = bulk.last_import
+    click.echo(f"Imported {rows} row(s) in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s): "
+               f"stage {timings['stage_seconds']:.2f}s "
+               f"({rows / max(timings['stage_seconds'], 1e-9):,.0f} rows/s), "
+               f"publish {timings['publish_seconds']:.2f}s "
+               f"({rows / max(timings['publish_seconds'], 1e-9):,.0f} rows/s).", err=True)
+
+
+@app.cli.command("gen-data")
+@click.option("--posts", type=int, default=10_000)
+@click.option("--comments-per-post", type=float, default=3.0, help="Mean comments per post.")
+@click.option("--caption-words", type=int, default=80, help="Median caption length in words.")
+@click.option("--caption-spread", type=float, default=0.8, help="Log-normal sigma of caption length.")
+@click.option("--seed", type=int, default=0)
+def gen_data_command(posts, comments_per_post, caption_words, caption_spread, seed):
+    """Add a synthetic feed to the database (point DATABASE_PATH at a scratch file)."""
+    init_db()
+    start = time.perf_counter()
+    rows = generate_dataset(connect(), posts, comments_per_post=comments_per_post,
+                            caption_words=caption_words, caption_spread=caption_spread, seed=seed)
+    click.echo(f"Generated {rows} row(s) in {time.perf_counter() - start:.1f}s.", err=True)
+
+
+LOAD_POST_SAMPLE = 1000
+
+
+@app.cli.command("load-test")
+@click.option("--target", default="inprocess",
+              help="'inprocess' (Flask test client), 'gunicorn' (started locally, "
+                   "needs gunicorn installed) or a base URL.")
+@click.option("--requests", "total", type=int, default=2000)
+@click.option("--concurrency", type=int, default=8)
+@click.option("--workers", type=int, default=4, help="gunicorn workers for --target gunicorn.")
+@click.option("--port", type=int, default=8765, help="Port for --target gunicorn.")
+@click.option("--routes", default=",".join(ROUTE_MIX), help="Comma-separated routes from the mix.")
+@click.option("--seed", type=int, default=0)
+@click.option("--out", type=click.Path(dir_okay=False), default=None, help="Also write the report here.")
+@click.option("--no-cache", is_flag=True,
+              help="Send Cache-Control: no-cache, so every page and search is rendered afresh.")
+def load_test_command(target, total, concurrency, workers, port, routes, seed, out, no_cache):
+    """Drive /, /lectures, /search_posts, /vote and /comments/add; print a JSON report.
+
+    Only 2xx responses count as successes. Without writes in the mix, /
+    and searches are mostly served from the page and search caches: each
+    route reports its cache_hit_share, and --no-cache measures the
+    uncached cost. Votes and comments are really written: run it against
+    a generated database.
+    """
+    mix = {}
+    for route in routes.split(","):
+        if route not in ROUTE_MIX:
+            raise click.BadParameter(f"unknown route {route!r}", param_hint="--routes")
+        mix[route] = ROUTE_MIX[route]
+
+    db = connect(readonly=True)
+    post_ids = [r[0] for r in db.execute(
+        "SELECT id FROM posts ORDER BY id DESC LIMIT ?", (LOAD_POST_SAMPLE,))]
+    if not post_ids:
+        raise click.ClickException("no posts: run 'flask gen-data' first")
+    dataset = {"posts": db.execute("SELECT COUNT(*) FROM posts").fetchone()[0],
+               "comments": db.execute("SELECT COUNT(*) FROM comments").fetchone()[0]}
+
+    server = None
+    if target == "inprocess":
+        driver = TestClientDriver(app, no_cache=no_cache)
+    elif target == "gunicorn":
+        if not shutil.which("gunicorn"):
+            raise click.ClickException("gunicorn is not installed")
+        env = dict(os.environ, DATABASE_PATH=os.path.abspath(DATABASE))
         try:
-            cur.execute("ALTER TABLE posts ADD COLUMN user_id INTEGER")
-        except Exception:
-            pass
+            server = start_gunicorn(os.path.dirname(os.path.abspath(__file__)), env, workers, port)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        driver = HttpDriver(f"http://127.0.0.1:{port}", no_cache=no_cache)
+    else:
+        driver = HttpDriver(target, no_cache=no_cache)
+
+    try:
+        result = run_load(driver, post_ids, total, concurrency, mix, seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    vote_counter.flush()
+
+    report = {"revision": git_revision(os.path.dirname(os.path.abspath(__file__))),
+              "target": target, "workers": workers if target == "gunicorn" else None,
+              "no_cache": no_cache,
+              "dataset": dataset, **result}
+    text = json.dumps(report, indent=2)
+    click.echo(text)
+    if out:
+        with open(out, "w") as f:
+            f.write(text + "\n")
+
 
-    # -------------------------
-    # INDEXES
-    # -------------------------
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_user_id ON posts(user_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_comments_post_id ON comments(post_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_title ON posts(title)")
+@app.cli.command("backfill-captions")
+@click.option("--workers", type=int, default=None, help="Renderer processes (default: CPU count).")
+def backfill_captions_command(workers):
+    """Render and store caption HTML for existing posts."""
+    updated = backfill_captions(workers=workers)
+    click.echo(f"Rendered {updated} caption(s).")
+
+
+app.cli.add_command(bench_fuzzy_command)
+app.cli.add_command(bench_votes_command)
 
-    conn.commit()
-    conn.close()
 
 # -------------------------
 # FEED / SEARCH LOGIC
 # -------------------------
-def get_feed_stack():
+FEED_PAGE_SIZE = 20
+FEED_MAX_LIMIT = 100
+FEED_STREAM_CHUNK = 5
+
+def _attachments_by_post(db, post_ids=None):
+    """Map post id -> attachment dicts, for the given posts (or all posts).
+
+    Callers skip posts whose post_stats.attachment_count is zero.
+    """
+    if post_ids is None:
+        rows = db.execute(
+            "SELECT id, post_id, filename, path FROM attachments ORDER BY post_id, id ASC"
+        )
+    elif not post_ids:
+        return {}
+    else:
+        marks = ",".join("?" * len(post_ids))
+        rows = db.execute(
+            f"SELECT id, post_id, filename, path FROM attachments WHERE post_id IN ({marks}) ORDER BY post_id, id ASC",
+            tuple(post_ids)
+        )
+
+    attachments = {}
+    for a in rows:
+        attachments.setdefault(a["post_id"], []).append({
+            "id": a["id"],
+            "filename": a["filename"],
+            "url": a["path"]
+        })
+    return attachments
+
+
+def _feed_post(r, attachments):
+    """Build the post dict the templates use from a joined feed row."""
+    caption_md = r["caption"] or ""
+    return {
+        "id": r["id"],
+        "user_id": r["user_id"],
+        "title": r["title"],
+        # keep markdown ONLY if you need editing later
+        "caption": caption_md,
+        # ALWAYS use this for display (rendered on write, see render_caption)
+        "caption_html": cached_caption_html(r),
+        "author": r["username"] or "Anonymous",
+        "post_type": r["post_type"],
+        "up": r["up"] or 0,
+        "down": r["down"] or 0,
+        "latest_comment": r["latest_comment"],
+        "latest_comment_time": r["latest_comment_time"],
+        "comment_count": r["comment_count"] or 0,
+        "attachments": attachments.get(r["id"], []),
+    }
+
+
+def get_feed_page(before=None, limit=FEED_PAGE_SIZE):
+    """One page of the feed, newest first, keyset-paginated on posts.id.
+
+    Returns (posts, next_before); next_before is the cursor for the following
+    page, or None when this is the last one. Cost depends on the page size
+    only, not on how many posts exist.
+    """
     db = get_db()
+    limit = max(1, min(int(limit), FEED_MAX_LIMIT))
+
+    where = "WHERE p.id < ?" if before is not None else ""
+    params = ((before,) if before is not None else ()) + (limit + 1,)
 
-    rows = db.execute("""
-        SELECT p.*, u.username
+    # one extra row tells us whether another page exists
+    rows = db.execute(f"""
+        SELECT p.*, u.username,
+               s.latest_comment,
+               s.latest_comment_at AS latest_comment_time,
+               s.comment_count, s.attachment_count
         FROM posts p
         LEFT JOIN users u ON p.user_id = u.id
+        LEFT JOIN post_stats s ON s.post_id = p.id
+        {where}
         ORDER BY p.id DESC
-    """).fetchall()
+        LIMIT ?
+    """, params).fetchall()
 
-    stack = Stack()
+    next_before = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_before = rows[-1]["id"]
 
-    for r in rows:
-        caption_md = r["caption"] or ""
+    attachments = _attachments_by_post(db, [r["id"] for r in rows if r["attachment_count"]])
+    return [_feed_post(r, attachments) for r in rows], next_before
 
-        post = {
-            "id": r["id"],
-            "user_id": r["user_id"],
-            "title": r["title"],
-            # keep markdown ONLY if you need editing later
-            "caption": caption_md,
-            # ALWAYS use this for display
-            "caption_html": md_to_safe_html(caption_md),
-            "author": r["username"] or "Anonymous",
-            "post_type": r["post_type"],
-            "up": r["up"] or 0,
-            "down": r["down"] or 0,
-        }
 
-        # latest comment
-        latest = db.execute(
-            "SELECT comment, created_at FROM comments WHERE post_id=? ORDER BY id DESC LIMIT 1",
-            (r["id"],)
-        ).fetchone()
+class FeedStream:
+    """Lazily fetched feed page for streamed templates.
+
+    Posts are loaded and enriched FEED_STREAM_CHUNK at a time while the
+    template renders. next_before is only known once iteration finishes,
+    so templates read it after their post loop.
+    """
 
-        post["latest_comment"] = latest["comment"] if latest else None
-        post["latest_comment_time"] = latest["created_at"] if latest else None
+    def __init__(self, head=(), before=None, limit=FEED_PAGE_SIZE, chunk=FEED_STREAM_CHUNK):
+        self.head = list(head)
+        self.before = before
+        self.limit = max(1, min(int(limit), FEED_MAX_LIMIT))
+        self.chunk = chunk
+        self.next_before = None
 
-        # attachments
-        atts = db.execute(
-            "SELECT id, filename, path FROM attachments WHERE post_id=? ORDER BY id ASC",
-            (r["id"],)
-        ).fetchall()
+    def __iter__(self):
+        db = get_db()
+        yield from add_related_counts(db, self.head)
+
+        before = self.before
+        remaining = self.limit
+        while remaining > 0:
+            posts, before = get_feed_page(before, min(self.chunk, remaining))
+            yield from add_related_counts(db, posts)
+            remaining -= len(posts)
+            if before is None:
+                break
+        self.next_before = before
+
+
+def add_related_counts(db, posts):
+    """Fill max_value / related_count on feed posts (see lectures())."""
+    real = [p for p in posts if p.get("id", 0) > 0]
+    # related_count: other posts sharing the first word of the title,
+    # for the whole batch in one query against the term index
+    counts = related_counts(db, real) if real else {}
+    for post in posts:
+        if post.get("id", 0) > 0:
+            # max_value: use caption or 'None'
+            post["max_value"] = post.get("caption") or "None"
+            post["related_count"] = counts.get(post["id"], 0)
+        else:
+            # interactive placeholders: show N/A
+            post["max_value"] = "N/A"
+            post["related_count"] = 0
+    return posts
 
-        post["attachments"] = [
-            {
-                "id": a["id"],
-                "filename": a["filename"],
-                "url": a["path"]
-            } for a in atts
-        ]
 
-        stack.push(post)
+def perform_bst_search(keyword):
+    """Titles containing keyword, from the process-wide title index."""
+    if not keyword:
+        return []
+    sync_search_indexes(get_db())
+    return [title for _, title in title_index.search(keyword)]
 
-    return stack.to_list()
 
+# -------------------------
+# PAGE CACHE
+# -------------------------
+page_cache = LRUCache(max_entries=256)
 
-def perform_bst_search(keyword):
-    posts = get_feed_stack()
-    bst = BST()
-    for post in posts:
-        title = post.get("title", "") or ""
-        bst.insert(title)
-    return bst.dfs_search(keyword)
+
+class _CachingStream:
+    """Pass a streamed body through, storing it in page_cache once fully sent.
+
+    close() is forwarded so stream_with_context can pop its request context
+    even when the client goes away before the body is consumed.
+    """
+
+    def __init__(self, chunks, key):
+        self.chunks = chunks
+        self.key = key
+
+    def __iter__(self):
+        parts = []
+        for chunk in self.chunks:
+            parts.append(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+            yield chunk
+        page_cache.set(self.key, b"".join(parts))
+
+    def close(self):
+        if hasattr(self.chunks, "close"):
+            self.chunks.close()
+
+
+def cached_page(f):
+    """Conditional GET + in-process response cache for full-page views.
+
+    The ETag and Last-Modified come from the global data version, so a
+    repeat view is a 304 or a cached body until something is written.
+    Entries are keyed on (endpoint, data version, logged-in user). A request
+    sent with Cache-Control: no-cache is always rendered afresh. X-Cache
+    says whether the response came from the cache (a 304 counts as a hit).
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != "GET":
+            return f(*args, **kwargs)
+
+        version, updated_at = get_data_version(get_db())
+        user_id = session.get("user_id") or 0
+        etag = f"{request.endpoint}-v{version}-u{user_id}"
+        last_modified = datetime.fromtimestamp(updated_at, tz=timezone.utc)
+
+        fresh = request.cache_control.no_cache
+        not_modified = not fresh and (request.if_none_match.contains(etag) or (
+            not request.if_none_match
+            and request.if_modified_since is not None
+            and request.if_modified_since >= last_modified
+        ))
+
+        key = (request.endpoint, version, user_id)
+        hit = True
+        if not_modified:
+            resp = app.response_class(status=304)
+        else:
+            body = None if fresh else page_cache.get(key)
+            if body is not None:
+                resp = app.response_class(body, mimetype="text/html")
+            else:
+                hit = False
+                resp = make_response(f(*args, **kwargs))
+                if resp.status_code == 200:
+                    if resp.is_streamed:
+                        resp.response = _CachingStream(resp.response, key)
+                    else:
+                        page_cache.set(key, resp.get_data())
+
+        resp.set_etag(etag)
+        resp.last_modified = last_modified
+        resp.headers["Cache-Control"] = "private, no-cache"
+        resp.headers["X-Cache"] = "hit" if hit else "miss"
+        resp.vary.add("Cookie")
+        return resp
+
+    return decorated_function
 
 
 # -------------------------
@@ -317,17 +659,23 @@ def oauth_google_login():
 
 
 @app.route("/", methods=["GET", "POST"])
+@cached_page
 def home():
     if request.method == "POST":
         keyword = request.form.get("search", "") or ""
 
         db = get_db()
-        sql_results = db.execute("""
-            SELECT id, title, caption 
-            FROM posts
-            WHERE title LIKE ? OR caption LIKE ?
-            ORDER BY id DESC
-        """, (f"%{keyword}%", f"%{keyword}%")).fetchall()
+        try:
+            sql_results, next_cursor, hit = cached_search_rows(
+                db, keyword,
+                limit=request.form.get("limit", SEARCH_LIMIT, type=int),
+                cursor=request.form.get("cursor"),
+                fresh=request.cache_control.no_cache
+            )
+        except ValueError:
+            return jsonify({"ok": False, "error": "invalid cursor"}), 400
+
+        counts = related_counts(db, sql_results)
 
         results = []
         for r in sql_results:
@@ -336,92 +684,111 @@ def home():
             caption = r["caption"] or ""
             max_value = caption if caption.strip() else "None"
 
-            # related_count: naive heuristic using first word of title
-            related_count = 0
-            if title.strip():
-                first_word = title.strip().split()[0]
-                q = db.execute(
-                    "SELECT COUNT(*) as c FROM posts WHERE (title LIKE ? OR caption LIKE ?) AND id != ?",
-                    (f"%{first_word}%", f"%{first_word}%", cid)
-                ).fetchone()
-                related_count = q["c"] if q is not None else 0
-
             results.append({
                 "id": cid,
                 "title": title,
                 "caption": caption,
                 "max_value": max_value,
-                "related_count": related_count
+                # related_count: naive heuristic using first word of title
+                "related_count": counts.get(cid, 0),
+                "latest_comment": r["latest_comment"],
+                "snippet": r["snippet"]
             })
-        # attach latest comment for each result (if present)
-        for item in results:
-            try:
-                latest = db.execute("SELECT comment FROM comments WHERE post_id=? ORDER BY id DESC LIMIT 1",
-                                    (item['id'],)).fetchone()
-                item['latest_comment'] = latest['comment'] if latest else None
-            except Exception:
-                item['latest_comment'] = None
 
-        return jsonify(results)
-    # default homepage load
-    posts = get_feed_stack()
-    return render_template("index.html", posts=posts, current_user=get_current_user_context())
+        return _search_response(results, next_cursor, hit)
+    # default homepage load (first feed page only)
+    posts, next_before = get_feed_page()
+    return render_template("index.html", posts=posts, next_before=next_before,
+                           current_user=get_current_user_context())
+
+
+@app.route("/feed")
+def feed():
+    """Keyset-paginated feed: /feed?before=<id>&limit=N[&format=html].
+
+    JSON by default; format=html returns the rendered post cards, with the
+    next cursor in the X-Next-Before header.
+    """
+    before = request.args.get("before", type=int)
+    limit = request.args.get("limit", FEED_PAGE_SIZE, type=int)
+    posts, next_before = get_feed_page(before, limit)
+
+    if request.args.get("format") == "html":
+        add_related_counts(get_db(), posts)
+        resp = make_response(render_template(
+            "_post_cards.html", posts=posts, current_user=get_current_user_context()
+        ))
+        resp.headers["X-Next-Before"] = "" if next_before is None else str(next_before)
+        return resp
+
+    return jsonify({"ok": True, "posts": posts, "next_before": next_before})
 
 
 @app.route("/search_posts")
 def search_posts():
+    """Search posts: ?q=&mode=fts|substring|fuzzy&limit=N&cursor=<X-Next-Cursor>."""
     q = request.args.get("q", "").strip()
+    # mode=substring: exact LIKE '%q%' matching (trigram-indexed)
+    # mode=fuzzy: typo-tolerant title/heading matching
+    mode = request.args.get("mode", "fts")
     db = get_db()
 
-    rows = db.execute("""
-        SELECT id, title, caption
-        FROM posts
-        WHERE title LIKE ? OR caption LIKE ?
-        ORDER BY id DESC
-    """, (f"%{q}%", f"%{q}%")).fetchall()
+    try:
+        rows, next_cursor, hit = cached_search_rows(
+            db, q, mode=mode,
+            limit=request.args.get("limit", SEARCH_LIMIT, type=int),
+            cursor=request.args.get("cursor"),
+            fresh=request.cache_control.no_cache
+        )
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid cursor"}), 400
 
     results = []
 
     for r in rows:
-        caption_md = r["caption"] or ""
-
         results.append({
             "id": r["id"],
             "title": r["title"] or "",
-            "caption_html": md_to_safe_html(caption_md),  # 
-            "related_count": 0
+            "caption_html": cached_caption_html(r),
+            "related_count": 0,
+            "latest_comment": r["latest_comment"],
+            "snippet": r["snippet"]
         })
 
-    # attach latest comment
-    for item in results:
-        latest = db.execute(
-            "SELECT comment FROM comments WHERE post_id=? ORDER BY id DESC LIMIT 1",
-            (item["id"],)
-        ).fetchone()
-        item["latest_comment"] = latest["comment"] if latest else None
+    return _search_response(results, next_cursor, hit)
 
-    return jsonify(results)
+
+def _search_response(results, next_cursor, hit):
+    """JSON list of results; the next page's cursor goes in X-Next-Cursor,
+    whether search_cache answered in X-Cache."""
+    resp = jsonify(results)
+    resp.headers["X-Next-Cursor"] = next_cursor or ""
+    resp.headers["X-Cache"] = "hit" if hit else "miss"
+    return resp
+
+
+@app.route("/search/suggest")
+def search_suggest():
+    """Top-k title / caption-term completions for the search box."""
+    q = request.args.get("q", "")
+    k = max(1, min(request.args.get("k", SUGGEST_LIMIT, type=int), 20))
+    return jsonify(suggest(get_db(), q, k))
 
 
+@app.route("/search/stats")
+def search_stats():
+    """Hit/miss counters of this worker's search result cache."""
+    return jsonify({"ok": True, "search_cache": search_cache.stats()})
+
 
 @app.route("/lectures", methods=["GET", "POST"])
+@cached_page
 def lectures():
     if request.method == "POST":
-        db = get_db()
-        db.execute("""
-            INSERT INTO posts(title, caption, author, post_type, up, down)
-            VALUES (?, ?, ?, ?, 0, 0)
-        """, (
-            request.form.get("title"),
-            request.form.get("caption"),
-            request.form.get("author", "Anonymous"),
-            request.form.get("post_type", "regular")
-        ))
-        db.commit()
+        add_post(None, request.form.get("title"), request.form.get("caption"),
+                 request.form.get("post_type", "regular"))
         return redirect(url_for("lectures"))
 
-    db_posts = get_feed_stack()
-
     interactive_posts = [
         {
             "id": -1,
@@ -460,78 +827,57 @@ def lectures():
         }
     ]
 
-    final_posts = interactive_posts + db_posts
-    # Enrich regular posts with two helper fields:
+    # Regular posts are enriched (see add_related_counts) with two helper fields:
     # - max_value: show the post's caption (or 'None')
     # - related_count: number of other posts that share a keyword from this title
-    db = get_db()
-    for post in final_posts:
-        try:
-            if post.get("id", 0) > 0:
-                # max_value: use caption or 'None'
-                post["max_value"] = post.get("caption") or "None"
-
-                # related_count: use the first word of the title to find related posts
-                title = (post.get("title") or "").strip()
-                if title:
-                    first_word = title.split()[0]
-                    q = db.execute(
-                        "SELECT COUNT(*) as c FROM posts WHERE (title LIKE ? OR caption LIKE ?) AND id != ?",
-                        (f"%{first_word}%", f"%{first_word}%", post["id"])
-                    ).fetchone()
-                    post["related_count"] = q["c"] if q is not None else 0
-                else:
-                    post["related_count"] = 0
-            else:
-                # interactive placeholders: show N/A
-                post["max_value"] = "N/A"
-                post["related_count"] = 0
-        except Exception:
-            post["max_value"] = post.get("caption") or "None"
-            post["related_count"] = 0
-
-    return render_template("lectures.html", posts=final_posts, current_user=get_current_user_context())
+    # Only the first page is rendered; the rest is fetched from /feed on scroll.
+    feed_stream = FeedStream(head=interactive_posts)
+    current_user = get_current_user_context()
 
+    if app.config["STREAM_LECTURES"]:
+        return app.response_class(stream_template(
+            "lectures.html", posts=feed_stream, feed=feed_stream, current_user=current_user
+        ))
 
-def get_caption_from_db(id):
-    # Connect to your database
-    import sqlite3
-    conn = sqlite3.connect('feed.db')  # replace with your DB file
-    cursor = conn.cursor()
-
-    # Fetch caption
-    cursor.execute("SELECT caption FROM captions WHERE id = ?", (id,))
-    row = cursor.fetchone()
-    conn.close()
-
-    return row[0] if row else None
+    final_posts = list(feed_stream)
+    return render_template("lectures.html", posts=final_posts, feed=feed_stream,
+                           current_user=current_user)
 
 
 @app.route("/lecture/<int:id>")
 def lecture(id):
-    caption_md = get_caption_from_db(id)
-
-    caption_html = bleach.clean(
-        markdown.markdown(
-            caption_md,
-            extensions=["fenced_code", "tables"]
-        ),
-        tags=[
-            "h1","h2","h3",
-            "p","strong","em",
-            "ul","ol","li",
-            "hr",
-            "code","pre","blockquote"
-        ],
-        strip=True
-    )
+    row = get_db().execute("SELECT caption, caption_html FROM posts WHERE id = ?", (id,)).fetchone()
+    if row is None:
+        return "Lecture not found", 404
 
     return render_template(
         "lecture.html",
-        caption_html=caption_html
+        caption_html=cached_caption_html(row)
     )
 
 
+def add_post(user_id, title, caption, post_type, attachments=()):
+    """Insert a post with its rendered caption and term index; returns its id.
+
+    attachments are (filename, saved path) pairs. The search indexes are
+    updated once the insert has committed.
+    """
+    caption_html, caption_digest = render_caption(caption)
+
+    def insert_post(conn):
+        post_id = conn.execute("""
+            INSERT INTO posts(user_id, title, caption, caption_html, caption_hash, post_type, up, down)
+            VALUES (?, ?, ?, ?, ?, ?, 0, 0)
+        """, (user_id, title, caption, caption_html, caption_digest, post_type)).lastrowid
+        conn.executemany("INSERT INTO attachments (post_id, filename, path) VALUES (?, ?, ?)",
+                         [(post_id, name, dest) for name, dest in attachments])
+        return post_id, index_post_terms(conn, post_id, title, caption)
+
+    post_id, changed_terms = run_write(insert_post)
+    post_saved(get_db(), post_id, title, caption, changed_terms)
+    return post_id
+
+
 @app.route("/create_post", methods=["POST"])
 def create_post():
     if not AuthManager.is_authenticated():
@@ -546,20 +892,14 @@ def create_post():
     caption = request.form.get("caption")
     post_type = request.form.get("post_type", "regular")
 
-    cur = db.cursor()
-    cur.execute("""
-        INSERT INTO posts(user_id, title, caption, post_type, up, down)
-        VALUES (?, ?, ?, ?, 0, 0)
-    """, (user.id, title, caption, post_type))
-    db.commit()
-    post_id = cur.lastrowid
-
-    # handle uploaded attachments (form field 'attachments', multiple allowed)
+    # handle uploaded attachments (form field 'attachments', multiple allowed);
+    # files are saved first so the writer only does the inserts
     try:
         files = request.files.getlist('attachments') if request.files else []
     except Exception:
         files = []
 
+    saved = []
     if files:
         upload_dir = os.path.join('static', 'uploads')
         os.makedirs(upload_dir, exist_ok=True)
@@ -570,12 +910,11 @@ def create_post():
             dest = os.path.join(upload_dir, safe_name)
             try:
                 f.save(dest)
-                db.execute("INSERT INTO attachments (post_id, filename, path) VALUES (?, ?, ?)",
-                           (post_id, f.filename, dest))
+                saved.append((f.filename, dest))
             except Exception:
                 pass
-        db.commit()
 
+    add_post(user.id, title, caption, post_type, saved)
     return redirect(url_for("lectures"))
 
 
@@ -597,9 +936,9 @@ def comments_add():
         return jsonify({'ok': False, 'error': 'empty comment'})
 
     # Keep whitespace as-is (do not strip)
-    db.execute("INSERT INTO comments (post_id, user_id, comment, parent_id) VALUES (?, NULL, ?, ?)",
-               (post_id_int, comment, parent_id))
-    db.commit()
+    run_write(lambda conn: conn.execute(
+        "INSERT INTO comments (post_id, user_id, comment, parent_id) VALUES (?, NULL, ?, ?)",
+        (post_id_int, comment, parent_id)))
 
     # return latest comment for convenience
     row = db.execute("SELECT id, comment, created_at FROM comments WHERE post_id=? ORDER BY id DESC LIMIT 1",
@@ -619,39 +958,54 @@ def comments_for_post(post_id):
 
 @app.route("/vote/<int:id>/<string:way>", methods=["POST"])
 def vote(id, way):
-    db = get_db()
-    if way == "up":
-        db.execute("UPDATE posts SET up = up + 1 WHERE id=?", (id,))
-    else:
-        db.execute("UPDATE posts SET down = down + 1 WHERE id=?", (id,))
-    db.commit()
-    row = db.execute("SELECT up, down FROM posts WHERE id=?", (id,)).fetchone()
-    if row:
-        return jsonify({"ok": True, "up": row[0], "down": row[1]})
+    """Count a vote; the reply carries optimistic counts (see votes.py)."""
+    counts = vote_counter.vote(id, way == "up")
+    if counts:
+        return jsonify({"ok": True, "up": counts[0], "down": counts[1]})
     return jsonify({"ok": False}), 404
 
 
-# schedule a cancellable delete from the UI (5 second delay)
-def perform_delete(post_id):
-    """Perform deletion using a fresh DB connection (safe from background threads)."""
-    try:
-        conn = sqlite3.connect(DATABASE)
-        conn.execute("DELETE FROM posts WHERE id=?", (post_id,))
-        conn.commit()
-        conn.close()
-    except Exception:
-        pass
-    finally:
-        try:
-            pending_deletes.pop(post_id, None)
-        except Exception:
-            pass
+# cancellable deletes from the UI, run by the scheduler after DELETE_DELAY
+DELETE_DELAY = 5.0
+
+
+def delete_posts(conn, post_ids):
+    """Scheduler job: delete posts with their comments and attachment rows.
+
+    Returns (post id, indexed terms, attachment file paths) per deleted post.
+    """
+    deleted = []
+    for post_id in post_ids:
+        terms = [r[0] for r in conn.execute("SELECT term FROM post_terms WHERE post_id=?", (post_id,))]
+        paths = [r[0] for r in conn.execute(
+            "DELETE FROM attachments WHERE post_id=? RETURNING path", (post_id,))]
+        conn.execute("DELETE FROM comments WHERE post_id=?", (post_id,))
+        if conn.execute("DELETE FROM posts WHERE id=?", (post_id,)).rowcount:
+            deleted.append((post_id, terms, paths))
+    return deleted
+
+
+def posts_deleted(deleted):
+    """After the delete commits: remove upload files, update this worker's search indexes."""
+    db = connect(readonly=True)
+    for post_id, terms, paths in deleted:
+        remove_files(paths)
+        post_deleted(post_id, db, terms)
+
+
+scheduler.register("delete_post", delete_posts, after=posts_deleted)
+register_maintenance(scheduler)
+
+
+@app.before_request
+def start_scheduler():
+    if scheduler.start():
+        start_maintenance(scheduler)
+        warm_search_indexes()
 
 
 @app.route("/delete/<int:id>", methods=["POST"])
 def schedule_delete(id):
-    global pending_deletes
-
     if not AuthManager.is_authenticated():
         return jsonify({"ok": False, "error": "login_required"}), 401
 
@@ -663,24 +1017,14 @@ def schedule_delete(id):
     if not post or post[0] != current_user.id:
         return jsonify({"ok": False, "error": "unauthorized"}), 403
 
-    if id in pending_deletes:
+    if not scheduler.schedule("delete_post", id, DELETE_DELAY):
         return jsonify({"ok": True, "pending": True})
-
-    t = threading.Timer(5.0, perform_delete, args=(id,))
-    pending_deletes[id] = t
-    t.start()
     return jsonify({"ok": True, "scheduled": True})
 
 
 @app.route('/delete/cancel/<int:id>', methods=['POST'])
 def cancel_delete(id):
-    global pending_deletes
-    t = pending_deletes.pop(id, None)
-    if t:
-        try:
-            t.cancel()
-        except Exception:
-            pass
+    if scheduler.cancel("delete_post", id):
         return jsonify({"ok": True, "cancelled": True})
     return jsonify({"ok": False, "error": "not_pending"}), 404
 
@@ -695,7 +1039,7 @@ def edit(id):
     current_user = AuthManager.get_current_user(db)
 
     # Check post ownership
-    post = db.execute("SELECT user_id FROM posts WHERE id=?", (id,)).fetchone()
+    post = db.execute("SELECT user_id, caption_hash FROM posts WHERE id=?", (id,)).fetchone()
     if not post or post[0] != current_user.id:
         return jsonify({"ok": False, "error": "unauthorized"}), 403
 
@@ -703,12 +1047,27 @@ def edit(id):
     title = request.form.get("title")
     caption = request.form.get("caption")
 
-    # Only update fields that were provided
-    if title is not None:
-        db.execute("UPDATE posts SET title=? WHERE id=?", (title, id))
-    if caption is not None:
-        db.execute("UPDATE posts SET caption=? WHERE id=?", (caption, id))
-    db.commit()
+    if title is None and caption is None:
+        return redirect(url_for("lectures"))
+
+    # re-render only when the caption text actually changed
+    rendered = None
+    if caption is not None and caption_hash(caption) != post["caption_hash"]:
+        rendered = render_caption(caption)
+
+    def update_post(conn):
+        # Only update fields that were provided
+        if title is not None:
+            conn.execute("UPDATE posts SET title=? WHERE id=?", (title, id))
+        if rendered is not None:
+            conn.execute("UPDATE posts SET caption=?, caption_html=?, caption_hash=? WHERE id=?",
+                         (caption, rendered[0], rendered[1], id))
+        # keep the keyword index in step with the edited text
+        row = conn.execute("SELECT title, caption FROM posts WHERE id=?", (id,)).fetchone()
+        return row, index_post_terms(conn, id, row["title"], row["caption"])
+
+    row, changed_terms = run_write(update_post)
+    post_saved(db, id, row["title"], row["caption"], changed_terms)
     return redirect(url_for("lectures"))
 
 
@@ -718,6 +1077,7 @@ def collaborators_page():
 
 # Queue endpoints
 @app.route("/queue/enqueue", methods=["POST"])
+@shared_state("queue")
 def queue_enqueue():
     val = request.json.get("value", "").strip()
     if not val:
@@ -727,6 +1087,7 @@ def queue_enqueue():
 
 
 @app.route("/queue/dequeue", methods=["POST"])
+@shared_state("queue")
 def queue_dequeue():
     if queue:
         queue.pop(0)
@@ -735,6 +1096,7 @@ def queue_dequeue():
 
 # Stack endpoints
 @app.route("/stack/push", methods=["POST"])
+@shared_state("stack")
 def stack_push():
     val = request.json.get("value", "").strip()
     if not val:
@@ -744,6 +1106,7 @@ def stack_push():
 
 
 @app.route("/stack/pop", methods=["POST"])
+@shared_state("stack")
 def stack_pop():
     if stack:
         stack.pop()
@@ -752,6 +1115,7 @@ def stack_pop():
 
 # Generic tree endpoints
 @app.route("/tree/insert", methods=["POST"])
+@shared_state("tree_roots")
 def tree_insert_route():
     global tree_root, tree_roots
     val = request.json.get("value", "").strip()
@@ -811,6 +1175,7 @@ def tree_insert_route():
 
 # BST endpoints
 @app.route("/bst/insert", methods=["POST"])
+@shared_state("bst_root")
 def bst_insert_route():
     global bst_root
     val = request.json.get("value", "").strip()
@@ -825,6 +1190,7 @@ def bst_insert_route():
 
 
 @app.route("/bst/search", methods=["POST"])
+@shared_state("bst_root", readonly=True)
 def bst_search_route():
     global bst_root
     val = request.json.get("value")
@@ -838,6 +1204,7 @@ def bst_search_route():
 
 
 @app.route("/bst/max", methods=["GET"])
+@shared_state("bst_root", readonly=True)
 def bst_max_route():
     global bst_root
     m = bst_find_max(bst_root)
@@ -845,6 +1212,7 @@ def bst_max_route():
 
 
 @app.route("/bst/height", methods=["GET"])
+@shared_state("bst_root", readonly=True)
 def bst_height_route():
     global bst_root
     h = bst_height(bst_root)
@@ -852,6 +1220,7 @@ def bst_height_route():
 
 
 @app.route("/bst/delete", methods=["POST"])
+@shared_state("bst_root", "pending_subtrees")
 def bst_delete_route():
     global bst_root
     val = request.json.get("value")
@@ -873,6 +1242,7 @@ def bst_delete_route():
 
 
 @app.route('/tree/delete', methods=['POST'])
+@shared_state("tree_roots", "pending_subtrees")
 def tree_delete_route():
     global tree_roots
     node_id = request.json.get('id')
@@ -934,6 +1304,7 @@ def tree_delete_route():
 
 
 @app.route('/tree/reset', methods=['POST'])
+@shared_state("tree_roots")
 def tree_reset():
     global tree_roots
     tree_roots.clear()
@@ -941,6 +1312,7 @@ def tree_reset():
 
 
 @app.route('/bt/delete', methods=['POST'])
+@shared_state("bt_roots", "pending_subtrees")
 def bt_delete_route():
     global bt_roots
     node_id = request.json.get('id')
@@ -998,6 +1370,7 @@ def bt_delete_route():
 
 
 @app.route('/reattach/<token>', methods=['POST'])
+@shared_state("pending_subtrees", "bst_root", "tree_roots", "bt_roots", "edge_weights")
 def reattach_subtree(token):
     global tree_root, bt_root, bst_root
     payload = request.get_json() or {}
@@ -1185,6 +1558,7 @@ def reattach_subtree(token):
     return jsonify({'ok': False, 'error': 'unknown_type'}), 400
 
 @app.route('/graph/svg')
+@shared_state("graph_vertices", "graph_edges", readonly=True)
 def graph_svg():
     return jsonify({"ok": True, "svg": render_graph_svg()})
 
@@ -1230,6 +1604,7 @@ def render_graph_svg():
 
 
 @app.route('/graph/add-vertex', methods=['POST'])
+@shared_state("graph_vertices", "graph_edges")
 def graph_add_vertex():
     label = (request.json.get('label') or '').strip()
     if not label:
@@ -1240,6 +1615,7 @@ def graph_add_vertex():
 
 
 @app.route('/graph/delete-vertex', methods=['POST'])
+@shared_state("graph_vertices", "graph_edges")
 def graph_delete_vertex():
     vid = request.json.get('id')
     if not vid: return jsonify({'ok': False})
@@ -1254,6 +1630,7 @@ def graph_delete_vertex():
 
 
 @app.route('/graph/add-edge', methods=['POST'])
+@shared_state("graph_vertices", "graph_edges")
 def graph_add_edge():
     u = request.json.get('u')
     v = request.json.get('v')
@@ -1267,6 +1644,7 @@ def graph_add_edge():
 
 
 @app.route('/graph/set-weight', methods=['POST'])
+@shared_state("graph_vertices", "graph_edges")
 def graph_set_weight():
     u = request.json.get('u')
     v = request.json.get('v')
@@ -1277,6 +1655,7 @@ def graph_set_weight():
 
 
 @app.route('/graph/reset', methods=['POST'])
+@shared_state("graph_vertices", "graph_edges")
 def graph_reset():
     graph_vertices.clear()
     graph_edges.clear()
@@ -1314,6 +1693,7 @@ def eleccirc():
     return render_template('eleccirc.html')
 
 @app.route("/bt/add-left", methods=["POST"])
+@shared_state("bt_roots")
 def bt_add_left():
     global bt_root, bt_roots
     data = request.get_json(silent=True) or {}
@@ -1376,6 +1756,7 @@ def bt_add_left():
 
 
 @app.route("/bt/add-right", methods=["POST"])
+@shared_state("bt_roots")
 def bt_add_right():
     global bt_root, bt_roots
     data = request.get_json(silent=True) or {}
@@ -1440,6 +1821,7 @@ def bt_add_right():
 
 
 @app.route("/bt/reset", methods=["POST"])
+@shared_state("bt_roots")
 def bt_reset():
     global bt_root
     global bt_roots
@@ -1448,6 +1830,7 @@ def bt_reset():
 
 
 @app.route("/bt/add-root", methods=["POST"])
+@shared_state("bt_roots")
 def bt_add_root():
     global bt_roots
     data = request.get_json(silent=True) or {}
@@ -1594,4 +1977,6 @@ app.register_blueprint(sorting_bp, url_prefix="/sorting")
 # RUN
 if __name__ == "__main__":
     init_db()
+    with app.app_context():
+        sync_search_indexes(get_db())
     app.run(debug=True)
\ No newline at end of file
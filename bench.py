@@ -0,0 +1,117 @@
+"""Benchmark commands, registered on the app's CLI by app.py.
+
+flask bench-fuzzy   FuzzyIndex build and lookup times on a synthetic corpus
+flask bench-votes   vote throughput, per-vote writer jobs vs. write-behind
+
+Neither touches the real database's data.
+"""
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import click
+
+from db import Writer, connect, pool
+from Search import SEARCH_LIMIT, FuzzyIndex
+from votes import VoteAccumulator
+
+
+FUZZY_BENCH_TOPICS = [
+    "queue", "stack", "dijkstra", "heap", "graph", "tree", "binary", "search",
+    "sorting", "quicksort", "mergesort", "linked", "list", "hash", "table",
+    "traversal", "recursion", "dynamic", "programming", "array", "matrix",
+    "trie", "kruskal", "prim", "bellman", "ford", "topological", "bubble",
+]
+
+
+@click.command("bench-fuzzy")
+@click.option("--posts", type=int, default=100_000, help="Synthetic posts to index.")
+@click.option("--vocab", type=int, default=20_000, help="Distinct filler words.")
+@click.option("--queries", type=int, default=200)
+@click.option("--seed", type=int, default=1)
+def bench_fuzzy_command(posts, vocab, queries, seed):
+    """Time FuzzyIndex build and lookups on a synthetic corpus (no database)."""
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    filler = ["".join(rng.choices(letters, k=rng.randint(3, 10))) for _ in range(vocab)]
+
+    index = FuzzyIndex()
+    start = time.perf_counter()
+    for pid in range(1, posts + 1):
+        title = " ".join(rng.sample(FUZZY_BENCH_TOPICS, 2) + rng.sample(filler, 2))
+        index.add(pid, title, f"## {rng.choice(FUZZY_BENCH_TOPICS)} {rng.choice(filler)}\nbody")
+    build = time.perf_counter() - start
+
+    def typo(word):
+        i = rng.randrange(len(word) - 1)
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+    click.echo(f"{posts} posts, {index.vocabulary_size} words indexed in {build:.1f}s")
+    for words in (1, 2):
+        samples = []
+        for _ in range(queries):
+            q = " ".join(typo(rng.choice(FUZZY_BENCH_TOPICS + filler)) for _ in range(words))
+            start = time.perf_counter()
+            index.search(q, stop=SEARCH_LIMIT)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        click.echo(f"{words}-word search ms: p50={samples[len(samples) // 2]:.2f} "
+                   f"p95={samples[int(len(samples) * 0.95)]:.2f} max={samples[-1]:.2f}")
+
+
+@click.command("bench-votes")
+@click.option("--votes", "total", type=int, default=2000, help="Votes per run.")
+@click.option("--threads", type=int, default=8)
+@click.option("--posts", type=int, default=50, help="Distinct posts voted on.")
+def bench_votes_command(total, threads, posts):
+    """Votes/sec: one writer job per vote vs. the write-behind accumulator.
+
+    Runs against a scratch copy of the database; the real one is untouched.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        source = connect(readonly=True)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        target.close()
+        ids = [r[0] for r in connect(path, readonly=True).execute(
+            "SELECT id FROM posts ORDER BY id DESC LIMIT ?", (posts,))]
+        if not ids:
+            raise click.ClickException("no posts to vote on")
+
+        def per_vote(bench_writer):
+            def cast(pid, up):
+                column = "up" if up else "down"
+                bench_writer.run(lambda conn: conn.execute(
+                    f"UPDATE posts SET {column} = {column} + 1 WHERE id=?", (pid,)))
+            return cast, lambda: None
+
+        def accumulated(bench_writer):
+            counter = VoteAccumulator(bench_writer, path)
+            return counter.vote, counter.flush
+
+        for label, make in (("writer job per vote", per_vote), ("write-behind", accumulated)):
+            bench_writer = Writer(path)
+            cast, finish = make(bench_writer)
+
+            def worker(n, seed):
+                rng = random.Random(seed)
+                for _ in range(n):
+                    cast(rng.choice(ids), rng.random() < 0.7)
+                pool.close_thread()
+
+            workers = [threading.Thread(target=worker, args=(total // threads, i))
+                       for i in range(threads)]
+            start = time.perf_counter()
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+            finish()
+            elapsed = time.perf_counter() - start
+            done = total // threads * threads
+            click.echo(f"{label}: {done} votes in {elapsed:.2f}s = {done / elapsed:,.0f} votes/s "
+                       f"({bench_writer.commits} commits)")
@@ -0,0 +1,313 @@
+"""Streaming JSONL export/import of posts, comments and attachments.
+
+One JSON object per line: {"type": "post" | "comment" | "attachment"}
+plus the row's columns. Both directions hold only one batch of rows in
+memory, so file size is not limited by RAM.
+
+import_jsonl() runs in two phases, so the app's own writes wait at most
+one short transaction:
+
+- staging: the whole file is parsed into temp tables made from the real
+  tables' CREATE statements (same columns, defaults and constraints),
+  IMPORT_BATCH rows per executemany(). Temp tables take no lock on the
+  database, and a bad record fails the import here, before anything is
+  published;
+- publishing: one short transaction reserves the file's ids, then the
+  staged rows are copied in IMPORT_COMMIT_POSTS posts (with their
+  comments and attachments) per transaction. Each transaction drops the
+  triggers on the loaded tables, rebuilds in bulk what they would have
+  maintained for its id range (post_stats, the FTS tables, post_terms, the
+  post change log, the data and search versions) and recreates them
+  before it commits, so no other connection sees them missing. FTS
+  segment merging is paused for each bulk insert and resumes with the
+  next write.
+
+An import that fails while publishing keeps the transactions already
+committed; each is complete on its own.
+
+Publishing, not staging, dominates: tokenizing every caption for the
+trigram index and sorting post_terms rows. last_import records the two
+phases separately.
+
+Ids in the file are shifted past each table's id sequence (references
+move with them), so an export loads into an empty database unchanged and
+into a populated one without collisions. The shifted range is reserved
+in sqlite_sequence before publishing starts, so rows the app inserts
+meanwhile get ids after it. user_id values are kept as they are. Running
+app processes pick the new posts up from the change log.
+"""
+import json
+import re
+import sys
+import time
+from operator import itemgetter
+
+from migrations import POST_STATS_BACKFILL_SQL, _id_ranges
+from Search import tokenize
+
+IMPORT_BATCH = 20_000
+IMPORT_COMMIT_POSTS = 2_000     # staged posts published per transaction
+IMPORT_CACHE_KIB = 64 * 1024    # page cache for the import's sorts and index builds
+FTS_AUTOMERGE = 4               # FTS5's default, restored after an import
+
+last_import = None
+
+dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+# export order; also the tables whose triggers an import defers
+BULK_TABLES = {"post": "posts", "comment": "comments", "attachment": "attachments"}
+# id columns an import shifts: column -> table whose id offset applies
+SHIFTED_COLUMNS = {
+    "posts": {"id": "posts"},
+    "comments": {"id": "comments", "post_id": "posts", "parent_id": "comments"},
+    "attachments": {"id": "attachments", "post_id": "posts"},
+}
+FTS_TABLES = ("posts_fts", "posts_trgm")
+
+
+def _columns(conn, table):
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def export_jsonl(conn, out):
+    """Write every post, comment and attachment to out. Returns rows written."""
+    written = 0
+    for kind, table in BULK_TABLES.items():
+        columns = _columns(conn, table)
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(IMPORT_BATCH)
+            if not rows:
+                break
+            out.write("".join(
+                dumps({"type": kind, **dict(zip(columns, row))}) + "\n" for row in rows))
+            written += len(rows)
+    return written
+
+
+def _deferred_triggers(conn):
+    """(name, sql) of the triggers on the loaded tables."""
+    marks = ",".join("?" * len(BULK_TABLES))
+    return conn.execute(
+        f"""SELECT name, sql FROM sqlite_master
+            WHERE type = 'trigger' AND sql IS NOT NULL AND tbl_name IN ({marks})""",
+        list(BULK_TABLES.values())
+    ).fetchall()
+
+
+def _max_id(conn, table):
+    return conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+
+
+def _create_stage(conn, table):
+    """temp.import_<table>, created from table's own CREATE statement."""
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                       (table,)).fetchone()[0]
+    conn.execute(re.sub(r'^CREATE TABLE\s+"?\w+"?', f"CREATE TEMP TABLE import_{table}", sql))
+
+
+class _Loader:
+    """Batches rows per (table, columns) into the staging tables with executemany.
+
+    A post's terms are staged as one JSON array; publishing unpacks them
+    with json_each(), in C, far cheaper than binding every (term, post_id)
+    pair from Python.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.columns = {t: set(_columns(conn, t)) for t in BULK_TABLES.values()}
+        self.layouts = {}   # (type, keys as written) -> (table, columns kept, getter)
+        self.pending = {}
+        self.terms = []
+        self.rows = 0
+        for table in BULK_TABLES.values():
+            _create_stage(conn, table)
+        conn.execute("CREATE TEMP TABLE import_terms (post_id INTEGER PRIMARY KEY, terms TEXT)")
+
+    def _layout(self, kind, keys):
+        table = BULK_TABLES[kind]
+        kept = tuple(k for k in keys if k in self.columns[table])
+        layout = self.layouts[kind, keys] = (table, kept, itemgetter(*kept))
+        return layout
+
+    def add(self, record):
+        kind = record.pop("type")
+        keys = tuple(record)
+        table, kept, getter = self.layouts.get((kind, keys)) or self._layout(kind, keys)
+        if table == "posts":
+            terms = set(tokenize(record.get("title")))
+            terms.update(tokenize(record.get("caption")))
+            self.terms.append((record["id"], dumps(list(terms))))
+            if len(self.terms) >= IMPORT_BATCH:
+                self._flush_terms()
+        batch = self.pending.get((table, kept))
+        if batch is None:
+            batch = self.pending[table, kept] = []
+        batch.append(getter(record) if len(kept) > 1 else (getter(record),))
+        if len(batch) >= IMPORT_BATCH:
+            self._flush(table, kept)
+
+    def _flush(self, table, keys):
+        rows = self.pending.pop((table, keys))
+        self.conn.executemany(
+            f"INSERT INTO import_{table} ({', '.join(keys)}) VALUES ({', '.join('?' * len(keys))})",
+            rows)
+        self.rows += len(rows)
+
+    def _flush_terms(self):
+        self.conn.executemany("INSERT INTO import_terms (post_id, terms) VALUES (?, ?)", self.terms)
+        self.terms = []
+
+    def finish(self):
+        """Flush the rows still batched; index the staged rows by post."""
+        for table, keys in list(self.pending):
+            self._flush(table, keys)
+        self._flush_terms()
+        self.conn.execute("CREATE INDEX temp.import_comments_post ON import_comments (post_id)")
+        self.conn.execute("CREATE INDEX temp.import_attachments_post ON import_attachments (post_id)")
+
+
+def _reserve_ids(conn):
+    """Move each table's id sequence past its staged rows. Returns {table: id offset}."""
+    offsets = {}
+    for table in BULK_TABLES.values():
+        row = conn.execute("SELECT seq FROM main.sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        offset = offsets[table] = max(_max_id(conn, table), row[0] if row else 0)
+        top = conn.execute(f"SELECT MAX(id) FROM import_{table}").fetchone()[0]
+        if top is None or top <= 0:
+            continue
+        if row is None:
+            conn.execute("INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)",
+                         (table, offset + top))
+        else:
+            conn.execute("UPDATE main.sqlite_sequence SET seq = ? WHERE name = ?",
+                         (offset + top, table))
+    return offsets
+
+
+def _publish_ranges(conn):
+    """(low, high] ranges of staged post ids, IMPORT_COMMIT_POSTS posts each.
+
+    The first and last are widened to take in comments and attachments
+    whose post is not in the file.
+    """
+    low, high = conn.execute("""
+        SELECT MIN(low), MAX(high) FROM (
+            SELECT MIN(id) - 1 AS low, MAX(id) AS high FROM import_posts
+            UNION ALL SELECT MIN(post_id) - 1, MAX(post_id) FROM import_comments
+            UNION ALL SELECT MIN(post_id) - 1, MAX(post_id) FROM import_attachments)
+    """).fetchone()
+    if low is None:
+        return []
+    ranges = list(_id_ranges(conn, "import_posts", IMPORT_COMMIT_POSTS)) or [(low, high)]
+    ranges[0] = (min(low, ranges[0][0]), ranges[0][1])
+    ranges[-1] = (ranges[-1][0], max(high, ranges[-1][1]))
+    return ranges
+
+
+def _publish(conn, low, high, offsets, triggers):
+    """Copy the staged posts in (low, high], with their comments, attachments and terms."""
+    shift = offsets["posts"]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for name, _ in triggers:
+            conn.execute(f'DROP TRIGGER "{name}"')
+        for table, key in (("posts", "id"), ("comments", "post_id"), ("attachments", "post_id")):
+            columns = _columns(conn, table)
+            shifted = SHIFTED_COLUMNS[table]
+            select = ", ".join(f"{c} + {offsets[shifted[c]]}" if c in shifted else c for c in columns)
+            conn.execute(f"""INSERT INTO {table} ({', '.join(columns)})
+                             SELECT {select} FROM import_{table} WHERE {key} > ? AND {key} <= ?""",
+                         (low, high))
+
+        # sorted: fills the (term, post_id) b-tree in key order
+        conn.execute("""INSERT OR IGNORE INTO post_terms (term, post_id)
+                        SELECT j.value, t.post_id + ? FROM import_terms t, json_each(t.terms) j
+                        WHERE t.post_id > ? AND t.post_id <= ? ORDER BY 1, 2""", (shift, low, high))
+        low, high = low + shift, high + shift
+        conn.execute(POST_STATS_BACKFILL_SQL, (low, high))
+        for fts in FTS_TABLES:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone():
+                # no incremental segment merges while the whole range goes in
+                conn.execute(f"INSERT INTO {fts} ({fts}, rank) VALUES ('automerge', 0)")
+                conn.execute(f"""INSERT INTO {fts} (rowid, title, caption)
+                                 SELECT id, title, caption FROM posts WHERE id > ? AND id <= ?""",
+                             (low, high))
+                conn.execute(f"INSERT INTO {fts} ({fts}, rank) VALUES ('automerge', ?)",
+                             (FTS_AUTOMERGE,))
+        conn.execute("INSERT INTO post_changes (post_id) SELECT id FROM posts WHERE id > ? AND id <= ?",
+                     (low, high))
+        conn.execute("""UPDATE data_version SET version = version + 1,
+                        updated_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = 1""")
+        conn.execute("UPDATE search_version SET version = version + 1 WHERE id = 1")
+        for _, sql in triggers:
+            conn.execute(sql)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def import_jsonl(conn, lines):
+    """Load JSONL lines into the database. Returns rows loaded.
+
+    Nothing is published unless the whole file stages cleanly. Timings go
+    to last_import: stage_seconds for reading, tokenizing and staging the
+    rows, publish_seconds for copying them in with their post_terms,
+    stats and FTS rows. conn must not be shared with other threads while
+    this runs.
+    """
+    global last_import
+    loads = json.loads
+    start = time.perf_counter()
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys=OFF")    # a no-op inside a transaction
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute(f"PRAGMA cache_size = -{IMPORT_CACHE_KIB}")
+    try:
+        conn.execute("BEGIN")   # temp tables only: takes no lock on the database
+        try:
+            loader = _Loader(conn)
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    loader.add(loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"line {number}: bad record ({e!r})") from None
+            loader.finish()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        staged = time.perf_counter()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            offsets = _reserve_ids(conn)
+            triggers = _deferred_triggers(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        for low, high in _publish_ranges(conn):
+            _publish(conn, low, high, offsets, triggers)
+    finally:
+        for table in ("import_terms",) + tuple(f"import_{t}" for t in BULK_TABLES.values()):
+            conn.execute(f"DROP TABLE IF EXISTS temp.{table}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute(f"PRAGMA cache_size = {cache_size}")
+    last_import = {
+        "rows": loader.rows,
+        "stage_seconds": round(staged - start, 3),
+        "publish_seconds": round(time.perf_counter() - staged, 3),
+    }
+    return loader.rows
+
+
+def open_jsonl(path, mode):
+    """path, or stdin/stdout for '-'."""
+    if path == "-":
+        return sys.stdin if mode == "r" else sys.stdout
+    return open(path, mode, encoding="utf-8", newline="\n")
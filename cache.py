@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Small thread-safe LRU cache, bounded by entry count.
+
+    Counts hits and misses so the size can be tuned (see stats()).
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def discard_where(self, predicate):
+        """Drop every entry for which predicate(key, value) is true."""
+        with self._lock:
+            stale = [k for k, v in self._data.items() if predicate(k, v)]
+            for k in stale:
+                del self._data[k]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,36 @@
+"""Markdown captions rendered to sanitized HTML, stored next to the source.
+
+Posts keep caption_html (and the caption_hash it was rendered from) so
+reads never run markdown or bleach; writes and backfills call
+render_caption().
+"""
+import hashlib
+
+import bleach
+import markdown
+
+
+def md_to_safe_html(md_text: str) -> str:
+    return bleach.clean(
+        markdown.markdown(
+            md_text or "",
+            extensions=["fenced_code", "tables"]
+        ),
+        tags=[
+            "h1","h2","h3",
+            "p","strong","em",
+            "ul","ol","li",
+            "hr",
+            "code","pre","blockquote"
+        ],
+        strip=True
+    )
+
+
+def caption_hash(md_text: str) -> str:
+    return hashlib.sha256((md_text or "").encode("utf-8")).hexdigest()
+
+
+def render_caption(md_text: str):
+    """Return (caption_html, caption_hash) to store next to a caption."""
+    return md_to_safe_html(md_text), caption_hash(md_text)
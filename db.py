@@ -1,18 +1,267 @@
 import sqlite3
+import threading
+import queue
+from concurrent.futures import Future
 from flask import g
 import os
 
-DATABASE = "feed.db"
+DATABASE = os.environ.get("DATABASE_PATH", "feed.db")
 
-def get_db():
-    if "db" not in g:
-        dir_name = os.path.dirname(DATABASE)
+# prepared statements kept per connection; the app issues well under this
+# many distinct SQL strings, so every hot query stays compiled
+STATEMENT_CACHE_SIZE = 256
+
+# how long the writer waits on another process's write lock before the
+# job fails (readers never wait: WAL lets them read alongside the writer)
+WRITE_TIMEOUT = 5
+WRITE_BATCH_MAX = 64
+
+
+class ConnectionPool:
+    """One initialized SQLite connection per (thread, database file, mode), reused.
+
+    Connections are opened and given their PRAGMAs once, then handed back
+    on every later acquire() from the same thread, so the statement cache
+    stays warm across requests. acquire() health-checks the connection:
+    a transaction left open by a failed request is rolled back, and a
+    connection that was closed, broken, or inherited across fork() is
+    replaced. A thread's connections are closed when the thread exits.
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _conns(self):
+        if self._pid != os.getpid():
+            # forked child: never reuse the parent's handles
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        return conns
+
+    def _open(self, path, readonly=False):
+        if readonly:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=self.timeout,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA query_only=ON;")
+            return conn
+        dir_name = os.path.dirname(path)
         if dir_name:  # only create folder if a directory exists
             os.makedirs(dir_name, exist_ok=True)
-        db = sqlite3.connect(DATABASE, timeout=30, check_same_thread=False)
-        db.row_factory = sqlite3.Row
-        db.execute("PRAGMA journal_mode=WAL;")
-        db.execute("PRAGMA synchronous=NORMAL;")
-        db.execute("PRAGMA foreign_keys=ON;")
-        g.db = db
+        conn = sqlite3.connect(path, timeout=self.timeout,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA foreign_keys=ON;")
+        return conn
+
+    @staticmethod
+    def _healthy(conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self, path=None, readonly=False):
+        """This thread's connection to path (default DATABASE).
+
+        readonly connections open the file with mode=ro and query_only, so
+        they never take the write lock.
+        """
+        path = path or DATABASE
+        key = (path, readonly)
+        conns = self._conns()
+        conn = conns.get(key)
+        if conn is not None and not self._healthy(conn):
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            conn = None
+        if conn is None:
+            conn = conns[key] = self._open(path, readonly)
+        return conn
+
+    def release(self, conn):
+        """Return a connection: end any open transaction, keep it open."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self.discard(conn)
+
+    def discard(self, conn):
+        """Close a connection and forget it."""
+        conns = self._conns()
+        for key, c in list(conns.items()):
+            if c is conn:
+                del conns[key]
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close_thread(self):
+        """Close every connection this thread holds (for short-lived threads)."""
+        for conn in list(self._conns().values()):
+            self.discard(conn)
+
+
+pool = ConnectionPool()
+
+
+class Writer:
+    """The process's single writer: one thread, one connection, a job queue.
+
+    Jobs are functions called as fn(conn, *args) on the writer thread.
+    Whatever is queued when the thread wakes up runs as one batch in one
+    transaction (group commit: one fsync for the batch). Each job runs in
+    its own savepoint, so a failing job is rolled back alone and its
+    exception is re-raised to its caller. Jobs must not commit.
+    """
+
+    def __init__(self, path=None, max_batch=WRITE_BATCH_MAX):
+        self.path = path
+        self.max_batch = max_batch
+        self.commits = 0
+        self.jobs = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                # first use, or a forked child that inherited no thread
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args):
+        """Queue fn(conn, *args); returns a Future for its result."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, fn, args))
+        return future
+
+    def run(self, fn, *args):
+        """submit() and wait: fn's result once its batch has committed."""
+        return self.submit(fn, *args).result()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path or DATABASE, timeout=WRITE_TIMEOUT,
+                               isolation_level=None, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA foreign_keys=ON;")
+        return conn
+
+    def _loop(self):
+        conn = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                if conn is None:
+                    conn = self._connect()
+                self._run_batch(conn, batch)
+            except sqlite3.Error as e:
+                # BEGIN or COMMIT failed: nothing in the batch was written
+                for future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                if conn is not None:
+                    try:
+                        if conn.in_transaction:
+                            conn.execute("ROLLBACK")
+                    except sqlite3.Error:
+                        conn.close()
+                        conn = None
+
+    def _run_batch(self, conn, batch):
+        outcomes = []
+        conn.execute("BEGIN IMMEDIATE")
+        for future, fn, args in batch:
+            conn.execute("SAVEPOINT job")
+            try:
+                result = fn(conn, *args)
+            except Exception as e:
+                conn.execute("ROLLBACK TO job")
+                conn.execute("RELEASE job")
+                outcomes.append((future, False, e))
+            else:
+                conn.execute("RELEASE job")
+                outcomes.append((future, True, result))
+        conn.execute("COMMIT")
+        self.commits += 1
+        self.jobs += len(batch)
+        # results are only visible to callers once they are durable
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+writer = Writer()
+
+
+def run_write(fn, *args):
+    """Run fn(conn, *args) on the writer thread; returns its result after commit."""
+    return writer.run(fn, *args)
+
+
+def connect(path=None, readonly=False):
+    """Pooled connection for code outside a request (CLI, threads, scripts).
+
+    Do not close() it; call pool.release() or just leave it for reuse.
+    """
+    return pool.acquire(path, readonly)
+
+
+def get_db():
+    """The request's read-only connection; writes go through run_write()."""
+    if "db" not in g:
+        g.db = pool.acquire(readonly=True)
     return g.db
+
+
+def release_db(error=None):
+    """Teardown: give the request's connection back to the pool."""
+    db = g.pop("db", None)
+    if db is not None:
+        pool.release(db)
+
+
+def get_data_version(db):
+    """Return (version, updated_at) of the feed data.
+
+    Triggers created by init_db() bump the version on every write to posts,
+    comments or attachments; updated_at is a unix timestamp.
+    """
+    row = db.execute("SELECT version, updated_at FROM data_version WHERE id = 1").fetchone()
+    if row is None:
+        return 0, 0
+    return row[0], row[1]
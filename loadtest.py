@@ -0,0 +1,271 @@
+"""Synthetic datasets and a concurrent load driver for the main routes.
+
+generate_dataset() writes a reproducible feed of any size through the
+bulk importer: caption lengths follow a log-normal distribution, comment
+counts per post a geometric one, and words are drawn Zipf-style from a
+fixed vocabulary, so searches hit both rare and common terms.
+
+run_load() sends a weighted mix of requests (ROUTE_MIX) from many threads,
+either in-process through the Flask test client or over HTTP to a running
+server (e.g. a local gunicorn), and returns per-route throughput,
+p50/p95/p99 latency and the share of responses served from the app's
+caches (X-Cache) as a JSON-ready dict for comparing commits. Only 2xx
+responses count as successes. Drivers made with no_cache=True send
+Cache-Control: no-cache, which makes the page and search caches render
+every response afresh.
+"""
+import json
+import math
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from itertools import accumulate
+
+from bulk import import_jsonl
+
+VOCAB_SIZE = 5000
+TOPICS = [
+    "queue", "stack", "graph", "tree", "heap", "sorting", "binary", "search",
+    "dijkstra", "hash", "linked", "list", "recursion", "traversal", "array",
+]
+
+# route -> relative weight in the default mix
+ROUTE_MIX = {"home": 3, "lectures": 1, "search": 3, "vote": 2, "comment": 1}
+
+
+def vocabulary(seed=0, size=VOCAB_SIZE):
+    """TOPICS followed by size pronounceable filler words, fixed per seed."""
+    rng = random.Random(seed)
+    consonants, vowels = "bcdfghklmnprstvz", "aeiou"
+    words = list(TOPICS)
+    seen = set(words)
+    while len(words) < len(TOPICS) + size:
+        word = "".join(rng.choice(consonants) + rng.choice(vowels)
+                       for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def synthetic_records(posts, comments_per_post=3.0, caption_words=80, caption_spread=0.8,
+                      seed=0, user_id=None):
+    """JSONL lines for a synthetic feed (ids from 1; the importer shifts them).
+
+    caption_words is the median caption length in words and caption_spread
+    the sigma of its log-normal distribution; comments_per_post is a mean.
+    """
+    rng = random.Random(seed)
+    words = vocabulary(seed)
+    # Zipf-like: the k-th word is drawn with weight 1/k
+    cum_weights = list(accumulate(1 / k for k in range(1, len(words) + 1)))
+    draw = lambda n: rng.choices(words, cum_weights=cum_weights, k=n)
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    mu = math.log(max(caption_words, 1))
+    p_stop = 1 / (1 + comments_per_post)   # geometric with the requested mean
+
+    comment_id = 0
+    for post_id in range(1, posts + 1):
+        length = max(1, int(rng.lognormvariate(mu, caption_spread)))
+        body = draw(length)
+        cut = rng.randrange(len(body))
+        caption = f"## {rng.choice(TOPICS)} {' '.join(draw(2))}\n\n" + " ".join(body[:cut]) + \
+                  "\n\n" + " ".join(body[cut:])
+        yield dumps({"type": "post", "id": post_id, "user_id": user_id,
+                     "title": " ".join([rng.choice(TOPICS)] + draw(3)).title(),
+                     "caption": caption, "post_type": "text",
+                     "up": rng.randint(0, 50), "down": rng.randint(0, 10)})
+        while rng.random() > p_stop:
+            comment_id += 1
+            yield dumps({"type": "comment", "id": comment_id, "post_id": post_id,
+                         "user_id": None, "comment": " ".join(draw(rng.randint(3, 30))),
+                         "parent_id": None})
+
+
+def generate_dataset(conn, posts, **options):
+    """Import a synthetic feed into conn's database. Returns rows written."""
+    return import_jsonl(conn, synthetic_records(posts, **options))
+
+
+# -------------------------
+# LOAD DRIVERS
+# -------------------------
+NO_CACHE_HEADERS = {"Cache-Control": "no-cache"}
+
+
+class TestClientDriver:
+    """Requests through the Flask test client, in this process.
+
+    send() returns (status, X-Cache header or None).
+    """
+
+    def __init__(self, app, no_cache=False):
+        self.app = app
+        self.headers = NO_CACHE_HEADERS if no_cache else {}
+
+    def session(self):
+        client = self.app.test_client()
+
+        def send(method, path, body=None):
+            resp = client.open(path, method=method, json=body, headers=self.headers)
+            resp.get_data()     # a streamed body is only rendered as it is read
+            resp.close()
+            return resp.status_code, resp.headers.get("X-Cache")
+        return send
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None     # urllib then raises HTTPError with the 3xx status
+
+
+class HttpDriver:
+    """Requests over HTTP to base_url (one connection per request).
+
+    Redirects are not followed, so a 3xx is reported as itself.
+    """
+
+    def __init__(self, base_url, timeout=30, no_cache=False):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.headers = NO_CACHE_HEADERS if no_cache else {}
+        self._opener = urllib.request.build_opener(_NoRedirect)
+
+    def session(self):
+        def send(method, path, body=None):
+            data = json.dumps(body).encode() if body is not None else None
+            headers = dict(self.headers)
+            if data:
+                headers["Content-Type"] = "application/json"
+            req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers=headers)
+            try:
+                with self._opener.open(req, timeout=self.timeout) as resp:
+                    resp.read()
+                    return resp.status, resp.headers.get("X-Cache")
+            except urllib.error.HTTPError as e:
+                return e.code, e.headers.get("X-Cache")
+            except OSError:
+                return 0, None
+        return send
+
+
+
+def _request(route, rng, post_ids, words):
+    """(method, path, json body) for one request of the given route."""
+    if route == "home":
+        return "GET", "/", None
+    if route == "lectures":
+        return "GET", "/lectures", None
+    if route == "search":
+        q = " ".join(rng.sample(words[:500], rng.choice((1, 1, 2))))
+        return "GET", f"/search_posts?q={q.replace(' ', '+')}", None
+    if route == "vote":
+        return "POST", f"/vote/{rng.choice(post_ids)}/{rng.choice(('up', 'up', 'down'))}", None
+    if route == "comment":
+        return "POST", "/comments/add", {"post_id": rng.choice(post_ids),
+                                         "comment": " ".join(rng.sample(words[:500], 6))}
+    raise ValueError(f"unknown route {route!r}")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_load(driver, post_ids, requests=2000, concurrency=8, mix=None, seed=0):
+    """Send requests from concurrency threads; returns the per-route report."""
+    mix = mix or ROUTE_MIX
+    routes, weights = list(mix), list(mix.values())
+    words = vocabulary(seed)
+    samples = {route: [] for route in routes}
+    errors = {route: 0 for route in routes}
+    caching = {route: [0, 0] for route in routes}     # [hits, responses with X-Cache]
+    lock = threading.Lock()
+
+    def worker(n, worker_seed):
+        rng = random.Random(worker_seed)
+        send = driver.session()
+        mine = {route: [] for route in routes}
+        failed = dict.fromkeys(routes, 0)
+        cached = {route: [0, 0] for route in routes}
+        for route in rng.choices(routes, weights, k=n):
+            method, path, body = _request(route, rng, post_ids, words)
+            start = time.perf_counter()
+            status, cache = send(method, path, body)
+            mine[route].append((time.perf_counter() - start) * 1000)
+            if not 200 <= status < 300:
+                failed[route] += 1
+            if cache is not None:
+                cached[route][0] += cache == "hit"
+                cached[route][1] += 1
+        with lock:
+            for route in routes:
+                samples[route].extend(mine[route])
+                errors[route] += failed[route]
+                caching[route][0] += cached[route][0]
+                caching[route][1] += cached[route][1]
+
+    share, extra = divmod(requests, concurrency)
+    threads = [threading.Thread(target=worker, args=(share + (i < extra), seed * 1000 + i))
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    def summary(values, failed, hits, reported):
+        values.sort()
+        return {
+            "requests": len(values),
+            "errors": failed,
+            # None: the route has no cache in front of it
+            "cache_hit_share": round(hits / reported, 3) if reported else None,
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50), 2) if values else None,
+            "p95_ms": round(percentile(values, 95), 2) if values else None,
+            "p99_ms": round(percentile(values, 99), 2) if values else None,
+        }
+
+    report = {route: summary(samples[route], errors[route], *caching[route]) for route in routes}
+    report["all"] = summary([v for route in routes for v in samples[route]], sum(errors.values()),
+                            sum(c[0] for c in caching.values()), sum(c[1] for c in caching.values()))
+    return {"seconds": round(elapsed, 2), "concurrency": concurrency, "routes": report}
+
+
+def start_gunicorn(app_dir, env, workers=4, port=8765, timeout=30):
+    """Start gunicorn on 127.0.0.1:port and wait for it to answer. Returns the process."""
+    proc = subprocess.Popen(
+        ["gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "app:app"],
+        cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {proc.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return proc
+        except urllib.error.HTTPError:
+            return proc     # any status: the server is answering
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def git_revision(cwd):
+    """Short HEAD commit of the checkout at cwd, or None outside git."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=cwd,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
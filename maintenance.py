@@ -0,0 +1,365 @@
+"""Database housekeeping: orphan cleanup, incremental vacuum, statistics.
+
+run_maintenance() deletes comments and attachment rows whose post is gone,
+removes upload files no attachment refers to, trims the post change log
+(Search.py) to its newest POST_CHANGES_KEEP rows, hands free pages back to the
+filesystem with PRAGMA incremental_vacuum and refreshes the planner's
+statistics (PRAGMA optimize, plus a full ANALYZE when asked). Every step
+works in bounded batches, each its own writer transaction, so requests
+keep being served while it runs. register_maintenance() runs it from the
+durable scheduler, on a thread of its own: hourly, with ANALYZE once a day.
+
+Incremental vacuum needs auto_vacuum=INCREMENTAL, which only a full VACUUM
+can switch on; convert_auto_vacuum() does that, on request only
+(`flask maintenance --convert-vacuum`).
+
+The WAL is watched too: maybe_checkpoint() checkpoints once feed.db-wal
+passes WAL_CHECKPOINT_BYTES (PASSIVE) or WAL_TRUNCATE_BYTES (TRUNCATE,
+which also shrinks the file), health() reports sizes and fragmentation,
+and backup() copies the database online in paged steps. These back the
+`flask db-maint` command.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from db import DATABASE, WRITE_TIMEOUT, connect, pool, writer
+
+GC_BATCH = 500                  # rows examined (or files checked) per transaction
+VACUUM_BATCH = 1000             # pages freed per transaction
+UPLOAD_DIR = os.path.join("static", "uploads")
+ORPHAN_FILE_GRACE = 3600        # create_post saves files before inserting their rows
+MAINTENANCE_INTERVAL = 3600
+ANALYZE_INTERVAL = 24 * 3600
+POST_CHANGES_KEEP = 10_000      # a process further behind rebuilds its search indexes
+
+WAL_CHECKPOINT_BYTES = 4 * 1024 * 1024
+WAL_TRUNCATE_BYTES = 64 * 1024 * 1024
+# seconds between WAL checks on the scheduler; 0 turns the check off
+WAL_CHECK_INTERVAL = float(os.environ.get("WAL_CHECK_INTERVAL", 60))
+BACKUP_PAGES = 256              # pages copied per backup step
+BACKUP_SLEEP = 0.01             # wait before retrying a step that found the source busy
+
+ORPHAN_TABLES = ("comments", "attachments")
+
+last_report = None
+
+
+def _delete_orphans(conn, table, after_id, limit):
+    """Writer job: delete rows of table in the next id window whose post is gone.
+
+    Returns (last id examined or None when done, rows deleted, file paths
+    of deleted attachments).
+    """
+    window = conn.execute(
+        f"""SELECT t.id, p.id IS NULL FROM {table} t LEFT JOIN posts p ON p.id = t.post_id
+            WHERE t.id > ? ORDER BY t.id LIMIT ?""",
+        (after_id, limit)
+    ).fetchall()
+    if not window:
+        return None, 0, []
+    dead = [row_id for row_id, orphan in window if orphan]
+    paths = []
+    if dead:
+        marks = ",".join("?" * len(dead))
+        if table == "attachments":
+            paths = [r[0] for r in conn.execute(
+                f"DELETE FROM attachments WHERE id IN ({marks}) RETURNING path", dead)]
+        else:
+            conn.execute(f"DELETE FROM comments WHERE id IN ({marks})", dead)
+    return window[-1][0], len(dead), paths
+
+
+def remove_files(paths):
+    """Unlink files; returns (files removed, bytes freed). Missing files are skipped."""
+    removed = freed = 0
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            continue
+        removed += 1
+        freed += size
+    return removed, freed
+
+
+def collect_orphan_rows(db_writer=writer, batch_size=GC_BATCH):
+    """Delete orphaned comments and attachments. Returns ({table: rows}, paths)."""
+    deleted = {}
+    paths = []
+    for table in ORPHAN_TABLES:
+        deleted[table] = 0
+        last_id = 0
+        while last_id is not None:
+            last_id, count, removed = db_writer.run(_delete_orphans, table, last_id, batch_size)
+            deleted[table] += count
+            paths.extend(removed)
+    return deleted, paths
+
+
+def orphan_files(path=None, upload_dir=UPLOAD_DIR, batch_size=GC_BATCH,
+                 grace=ORPHAN_FILE_GRACE):
+    """Upload files older than grace that no attachment row refers to."""
+    if not os.path.isdir(upload_dir):
+        return []
+    cutoff = time.time() - grace
+    db = connect(path, readonly=True)
+    candidates = (os.path.join(upload_dir, e.name) for e in os.scandir(upload_dir)
+                  if e.is_file() and e.stat().st_mtime < cutoff)
+    orphans = []
+    while True:
+        chunk = [p for _, p in zip(range(batch_size), candidates)]
+        if not chunk:
+            return orphans
+        marks = ",".join("?" * len(chunk))
+        referenced = {r[0] for r in db.execute(
+            f"SELECT path FROM attachments WHERE path IN ({marks})", chunk)}
+        orphans.extend(p for p in chunk if p not in referenced)
+
+
+def _prune_post_changes(conn, keep, limit):
+    """Writer job: delete up to limit change log rows older than the newest keep."""
+    return conn.execute("""
+        DELETE FROM post_changes WHERE seq IN (
+            SELECT seq FROM post_changes
+            WHERE seq <= (SELECT MAX(seq) FROM post_changes) - ?
+            ORDER BY seq LIMIT ?)""", (keep, limit)).rowcount
+
+
+def prune_post_changes(db_writer=writer, keep=POST_CHANGES_KEEP, batch_size=GC_BATCH):
+    """Trim the post change log. Returns rows deleted."""
+    pruned = 0
+    while True:
+        count = db_writer.run(_prune_post_changes, keep, batch_size)
+        pruned += count
+        if count < batch_size:
+            return pruned
+
+
+def _vacuum_step(conn, max_pages):
+    """Writer job: free up to max_pages pages. Returns (pages freed, pages still free).
+
+    Each execute() of the pragma frees one page: the sqlite3 module steps
+    a statement that returns no rows only once.
+    """
+    freed = 0
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free and freed < max_pages:
+        conn.execute("PRAGMA incremental_vacuum(1)")
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= free:
+            break   # auto_vacuum is not INCREMENTAL on this database
+        freed += free - remaining
+        free = remaining
+    return freed, free
+
+
+def incremental_vacuum(db_writer=writer, batch_size=VACUUM_BATCH):
+    """Return free pages to the filesystem. Returns (pages, bytes) reclaimed."""
+    page_size = connect(db_writer.path, readonly=True).execute("PRAGMA page_size").fetchone()[0]
+    pages = 0
+    while True:
+        freed, free = db_writer.run(_vacuum_step, batch_size)
+        pages += freed
+        if not freed or not free:
+            return pages, pages * page_size
+
+
+def convert_auto_vacuum(path=None):
+    """Switch the database to auto_vacuum=INCREMENTAL. Returns False if it already was.
+
+    The setting only takes effect through a full VACUUM, which rewrites
+    the whole file: writers in every process wait until it finishes, and
+    it needs free disk space about the size of the database. Until it has
+    run, incremental_vacuum() has nothing to give back.
+    """
+    conn = sqlite3.connect(path or DATABASE, timeout=WRITE_TIMEOUT, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+def _optimize(conn, analyze):
+    if analyze:
+        conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+
+
+def run_maintenance(analyze=False, db_writer=writer, upload_dir=UPLOAD_DIR,
+                    grace=ORPHAN_FILE_GRACE):
+    """One full pass. Returns a report dict, also kept in last_report."""
+    global last_report
+    start = time.perf_counter()
+    deleted, paths = collect_orphan_rows(db_writer)
+    paths.extend(orphan_files(db_writer.path, upload_dir, grace=grace))
+    files, file_bytes = remove_files(paths)
+    changes = prune_post_changes(db_writer)
+    pages, page_bytes = incremental_vacuum(db_writer)
+    db_writer.run(_optimize, analyze)
+    last_report = {
+        "comments": deleted["comments"],
+        "attachments": deleted["attachments"],
+        "files": files,
+        "file_bytes": file_bytes,
+        "post_changes": changes,
+        "pages": pages,
+        "page_bytes": page_bytes,
+        "analyzed": analyze,
+        "seconds": round(time.perf_counter() - start, 3),
+        "finished_at": time.time(),
+    }
+    return last_report
+
+
+def wal_bytes(path=None):
+    try:
+        return os.path.getsize((path or DATABASE) + "-wal")
+    except OSError:
+        return 0
+
+
+def checkpoint(mode="PASSIVE", path=None):
+    """Run a WAL checkpoint. Returns (busy, wal frames, frames checkpointed).
+
+    PASSIVE copies what it can without waiting. TRUNCATE waits (up to
+    WRITE_TIMEOUT) for readers to finish, copies everything and empties
+    the WAL file; writers wait while it does.
+    """
+    mode = mode.upper()
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"unknown checkpoint mode {mode!r}")
+    conn = sqlite3.connect(path or DATABASE, timeout=WRITE_TIMEOUT, isolation_level=None)
+    try:
+        return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+    finally:
+        conn.close()
+
+
+def maybe_checkpoint(path=None):
+    """Checkpoint if the WAL has outgrown its thresholds. Returns the mode used or None."""
+    size = wal_bytes(path)
+    if size >= WAL_TRUNCATE_BYTES:
+        mode = "TRUNCATE"
+    elif size >= WAL_CHECKPOINT_BYTES:
+        mode = "PASSIVE"
+    else:
+        return None
+    checkpoint(mode, path)
+    return mode
+
+
+def health(path=None, detailed=True):
+    """Sizes and fragmentation of the database file and its WAL.
+
+    detailed adds the unused space inside allocated pages (from the dbstat
+    table, which reads every page); it is None where dbstat is unavailable.
+    """
+    db = connect(path, readonly=True)
+    page_size = db.execute("PRAGMA page_size").fetchone()[0]
+    page_count = db.execute("PRAGMA page_count").fetchone()[0]
+    freelist = db.execute("PRAGMA freelist_count").fetchone()[0]
+    report = {
+        "db_bytes": os.path.getsize(path or DATABASE),
+        "wal_bytes": wal_bytes(path),
+        "page_size": page_size,
+        "page_count": page_count,
+        "freelist_count": freelist,
+        "free_pct": round(100.0 * freelist / page_count, 1) if page_count else 0.0,
+        "auto_vacuum": ("none", "full", "incremental")[db.execute("PRAGMA auto_vacuum").fetchone()[0]],
+        "unused_pct": None,
+    }
+    if detailed:
+        try:
+            total, unused = db.execute("SELECT SUM(pgsize), SUM(unused) FROM dbstat").fetchone()
+            report["unused_pct"] = round(100.0 * (unused or 0) / total, 1) if total else 0.0
+        except sqlite3.OperationalError:
+            pass    # SQLite built without SQLITE_ENABLE_DBSTAT_VTAB
+    return report
+
+
+def backup(dest, path=None, pages=BACKUP_PAGES, progress=None):
+    """Copy the live database to dest with the backup API, pages at a time.
+
+    The copy reads one WAL snapshot, so it is consistent as of its start
+    and writers are never blocked. It is written next to dest and renamed
+    into place when complete. Returns the pages copied.
+    """
+    dest_dir = os.path.dirname(os.path.abspath(dest))
+    os.makedirs(dest_dir, exist_ok=True)
+    partial = dest + ".partial"
+    source = sqlite3.connect(f"file:{path or DATABASE}?mode=ro", uri=True, timeout=WRITE_TIMEOUT,
+                             isolation_level=None)
+    target = sqlite3.connect(partial)
+    try:
+        # pin one WAL snapshot: steps read from it, so concurrent commits
+        # neither wait for the copy nor restart it
+        source.execute("BEGIN")
+        source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        source.backup(target, pages=pages, progress=progress, sleep=BACKUP_SLEEP)
+        copied = target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+    os.replace(partial, dest)
+    return copied
+
+
+def _claim(conn, target_ids):
+    """Scheduler job: claiming the row is all; the work runs after commit."""
+    return target_ids
+
+
+def _off_thread(name, work, reschedule):
+    """Scheduler after-hook that runs work() on its own thread.
+
+    A pass can take minutes; the scheduler thread goes straight back to
+    its other jobs meanwhile. reschedule() runs once work() is done, so a
+    job never overlaps its previous run.
+    """
+    running = threading.Lock()
+
+    def run():
+        try:
+            work()
+        finally:
+            try:
+                reschedule()
+            finally:
+                running.release()
+                pool.close_thread()
+
+    def after(_):
+        if running.acquire(blocking=False):
+            threading.Thread(target=run, name=name, daemon=True).start()
+
+    return after
+
+
+def register_maintenance(scheduler):
+    """Run maintenance hourly, ANALYZE daily and the WAL check every
+    WAL_CHECK_INTERVAL seconds on scheduler (each job reschedules itself).
+    The work runs on a thread of its own, not the scheduler's."""
+    scheduler.register("maintenance", _claim, after=_off_thread(
+        "maintenance", run_maintenance,
+        lambda: scheduler.schedule("maintenance", 0, MAINTENANCE_INTERVAL)))
+    scheduler.register("analyze", _claim, after=_off_thread(
+        "analyze", lambda: run_maintenance(analyze=True),
+        lambda: scheduler.schedule("analyze", 0, ANALYZE_INTERVAL)))
+    scheduler.register("checkpoint", _claim, after=_off_thread(
+        "checkpoint", lambda: maybe_checkpoint(scheduler.path),
+        lambda: scheduler.schedule("checkpoint", 0, WAL_CHECK_INTERVAL)))
+
+
+def start_maintenance(scheduler):
+    """Make sure the recurring jobs exist (a no-op when they are pending)."""
+    scheduler.schedule("maintenance", 0, MAINTENANCE_INTERVAL)
+    scheduler.schedule("analyze", 0, ANALYZE_INTERVAL)
+    if WAL_CHECK_INTERVAL:
+        scheduler.schedule("checkpoint", 0, WAL_CHECK_INTERVAL)
@@ -0,0 +1,369 @@
+"""Numbered schema migrations, tracked in PRAGMA user_version.
+
+Each migration runs once, in order, and user_version records the last one
+applied, so starting against a current database is a single PRAGMA read.
+Migrations are idempotent (IF NOT EXISTS, column checks, backfills that
+skip done rows): one interrupted part-way simply runs again on the next
+start. Backfills commit in batches of MIGRATION_BATCH rows so a large
+feed.db is migrated in bounded transactions. Add new migrations at the end
+of MIGRATIONS; never renumber or edit one that has shipped.
+"""
+import os
+
+from captions import render_caption
+from Search import (POST_CHANGES_SQL, POST_TERMS_SQL, backfill_post_terms, create_fts,
+                    create_search_version)
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+MIGRATION_BATCH = 1000
+
+# Per-post aggregates kept current by triggers so feed and search rows need
+# a single indexed lookup instead of recomputing them on every request.
+POST_STATS_SQL = """
+CREATE TABLE IF NOT EXISTS post_stats (
+    post_id INTEGER PRIMARY KEY,
+    comment_count INTEGER NOT NULL DEFAULT 0,
+    attachment_count INTEGER NOT NULL DEFAULT 0,
+    latest_comment_id INTEGER,
+    latest_comment TEXT,
+    latest_comment_at TIMESTAMP
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_post_stats_post_insert
+AFTER INSERT ON posts BEGIN
+    INSERT OR IGNORE INTO post_stats (post_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_post_stats_post_delete
+AFTER DELETE ON posts BEGIN
+    DELETE FROM post_stats WHERE post_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_post_stats_comment_insert
+AFTER INSERT ON comments BEGIN
+    INSERT INTO post_stats (post_id, comment_count, latest_comment_id, latest_comment, latest_comment_at)
+    VALUES (NEW.post_id, 1, NEW.id, NEW.comment, NEW.created_at)
+    ON CONFLICT(post_id) DO UPDATE SET
+        comment_count = comment_count + 1,
+        -- comments can arrive out of id order (imports, restores): only a
+        -- newer one replaces the latest_* columns
+        latest_comment_id = CASE WHEN latest_comment_id IS NULL OR excluded.latest_comment_id > latest_comment_id
+                                 THEN excluded.latest_comment_id ELSE latest_comment_id END,
+        latest_comment = CASE WHEN latest_comment_id IS NULL OR excluded.latest_comment_id > latest_comment_id
+                              THEN excluded.latest_comment ELSE latest_comment END,
+        latest_comment_at = CASE WHEN latest_comment_id IS NULL OR excluded.latest_comment_id > latest_comment_id
+                                 THEN excluded.latest_comment_at ELSE latest_comment_at END;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_post_stats_comment_update
+AFTER UPDATE OF comment ON comments BEGIN
+    UPDATE post_stats SET latest_comment = NEW.comment
+    WHERE post_id = NEW.post_id AND latest_comment_id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_post_stats_comment_delete
+AFTER DELETE ON comments BEGIN
+    UPDATE post_stats SET comment_count = MAX(comment_count - 1, 0)
+    WHERE post_id = OLD.post_id;
+    UPDATE post_stats SET
+        latest_comment_id = (SELECT MAX(id) FROM comments WHERE post_id = OLD.post_id),
+        latest_comment = (SELECT comment FROM comments WHERE post_id = OLD.post_id ORDER BY id DESC LIMIT 1),
+        latest_comment_at = (SELECT created_at FROM comments WHERE post_id = OLD.post_id ORDER BY id DESC LIMIT 1)
+    WHERE post_id = OLD.post_id AND latest_comment_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_post_stats_attachment_insert
+AFTER INSERT ON attachments BEGIN
+    INSERT INTO post_stats (post_id, attachment_count) VALUES (NEW.post_id, 1)
+    ON CONFLICT(post_id) DO UPDATE SET attachment_count = attachment_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_post_stats_attachment_delete
+AFTER DELETE ON attachments BEGIN
+    UPDATE post_stats SET attachment_count = MAX(attachment_count - 1, 0)
+    WHERE post_id = OLD.post_id;
+END;
+"""
+
+# Global data version: any write to feed data bumps it. Pages derive their
+# ETag / Last-Modified from it and the response cache is keyed on it.
+DATA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS data_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO data_version (id, version, updated_at)
+VALUES (1, 0, CAST(strftime('%s', 'now') AS INTEGER));
+"""
+
+DATA_VERSION_TABLES = ("posts", "comments", "attachments")
+
+DATA_VERSION_TRIGGER_SQL = """
+CREATE TRIGGER IF NOT EXISTS trg_data_version_{table}_{event}
+AFTER {event} ON {table} BEGIN
+    UPDATE data_version
+    SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id = 1;
+END;
+"""
+
+# fills post_stats for posts in an id range that have no row yet
+POST_STATS_BACKFILL_SQL = """
+INSERT INTO post_stats (post_id, comment_count, attachment_count,
+                        latest_comment_id, latest_comment, latest_comment_at)
+SELECT p.id,
+       (SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id),
+       (SELECT COUNT(*) FROM attachments a WHERE a.post_id = p.id),
+       lc.id, lc.comment, lc.created_at
+FROM posts p
+LEFT JOIN comments lc ON lc.id = (SELECT MAX(id) FROM comments WHERE post_id = p.id)
+WHERE p.id > ? AND p.id <= ? AND p.id NOT IN (SELECT post_id FROM post_stats)
+"""
+
+
+def _columns(conn, table):
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(conn, table, column, decl):
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _id_ranges(conn, table, batch_size=MIGRATION_BATCH):
+    """(low, high] id ranges covering table, batch_size rows each."""
+    last_id = 0
+    while True:
+        row = conn.execute(
+            f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?)",
+            (last_id, batch_size)
+        ).fetchone()
+        if row[0] is None:
+            return
+        yield last_id, row[0]
+        last_id = row[0]
+
+
+# -------------------------
+# MIGRATIONS
+# -------------------------
+def base_schema(conn):
+    if os.path.exists(SCHEMA_FILE):
+        with open(SCHEMA_FILE) as f:
+            conn.executescript(f.read())
+        return
+    # Fallback minimal schema
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE,
+        password TEXT,
+        oauth_provider TEXT,
+        oauth_id TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS posts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        title TEXT NOT NULL,
+        caption TEXT NOT NULL,
+        post_type TEXT NOT NULL DEFAULT 'text',
+        up INTEGER NOT NULL DEFAULT 0,
+        down INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS comments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        post_id INTEGER NOT NULL,
+        user_id INTEGER,
+        comment TEXT NOT NULL,
+        parent_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (post_id) REFERENCES posts(id),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    );
+    """)
+
+
+def comment_replies(conn):
+    _add_column(conn, "comments", "parent_id", "INTEGER")
+
+
+def attachments(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS attachments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        post_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        path TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(post_id) REFERENCES posts(id) ON DELETE CASCADE
+    )
+    """)
+
+
+def post_owners(conn):
+    _add_column(conn, "posts", "user_id", "INTEGER")
+
+
+def caption_cache(conn):
+    _add_column(conn, "posts", "caption_html", "TEXT")
+    _add_column(conn, "posts", "caption_hash", "TEXT")
+    backfill_caption_html(conn)
+
+
+def backfill_caption_html(conn):
+    # render the captions still missing their HTML, one id range at a time
+    # (`flask backfill-captions` does the same over a process pool)
+    for low, high in _id_ranges(conn, "posts"):
+        rows = conn.execute(
+            "SELECT id, caption FROM posts WHERE id > ? AND id <= ? AND caption_html IS NULL",
+            (low, high)).fetchall()
+        conn.executemany(
+            "UPDATE posts SET caption_html=?, caption_hash=? WHERE id=?",
+            [(*render_caption(caption), pid) for pid, caption in rows])
+        conn.commit()
+
+
+def post_stats(conn):
+    conn.executescript(POST_STATS_SQL)
+    for low, high in _id_ranges(conn, "posts"):
+        conn.execute(POST_STATS_BACKFILL_SQL, (low, high))
+        conn.commit()
+
+
+def post_terms(conn):
+    conn.executescript(POST_TERMS_SQL)
+    backfill_post_terms(conn, batch_size=MIGRATION_BATCH)
+
+
+def full_text_search(conn):
+    # skipped (searches fall back to LIKE) when sqlite lacks fts5
+    create_fts(conn)
+
+
+def data_version(conn):
+    conn.executescript(DATA_VERSION_SQL)
+    for table in DATA_VERSION_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.executescript(DATA_VERSION_TRIGGER_SQL.format(table=table, event=event))
+
+
+def base_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_user_id ON posts(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_post_id ON comments(post_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_title ON posts(title)")
+
+
+def lookup_indexes(conn):
+    # covering: the feed's per-page attachment lookup reads only these columns
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_attachments_post
+                    ON attachments(post_id, id, filename, path)""")
+    # covering: OAuth login looks users up by provider id
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_users_oauth
+                    ON users(oauth_provider, oauth_id, username, email)""")
+
+
+def scheduled_jobs(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            target_id INTEGER NOT NULL,
+            run_at REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (kind, target_id)
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_run_at ON scheduled_jobs(run_at)")
+
+
+def attachments_path_index(conn):
+    # orphan cleanup looks files up by path. Converting auto_vacuum takes a
+    # full VACUUM, so it is left to `flask maintenance --convert-vacuum`.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_attachments_path ON attachments(path)")
+
+
+def comment_count_fix(conn):
+    # the shipped comment trigger skipped the count for out-of-order ids:
+    # replace it and recount
+    conn.execute("DROP TRIGGER IF EXISTS trg_post_stats_comment_insert")
+    conn.executescript(POST_STATS_SQL)
+    for low, high in _id_ranges(conn, "posts"):
+        conn.execute("""
+            UPDATE post_stats
+            SET comment_count = (SELECT COUNT(*) FROM comments c WHERE c.post_id = post_stats.post_id)
+            WHERE post_id > ? AND post_id <= ?
+        """, (low, high))
+        conn.commit()
+
+
+def demo_state(conn):
+    # shared values of the demo globals (see state.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS demo_state (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+
+
+def post_changes(conn):
+    # replayed by every process into its in-memory search indexes (Search.py)
+    conn.executescript(POST_CHANGES_SQL)
+
+
+def search_version(conn):
+    # search result cache key: bumped by post and comment writes, not votes (Search.py)
+    create_search_version(conn)
+
+
+MIGRATIONS = [
+    (1, base_schema),
+    (2, comment_replies),
+    (3, attachments),
+    (4, post_owners),
+    (5, caption_cache),
+    (6, post_stats),
+    (7, post_terms),
+    (8, full_text_search),
+    (9, data_version),
+    (10, base_indexes),
+    (11, lookup_indexes),
+    (12, scheduled_jobs),
+    (13, attachments_path_index),
+    (14, demo_state),
+    (15, comment_count_fix),
+    (16, post_changes),
+    (17, backfill_caption_html),
+    (18, search_version),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=LATEST_VERSION):
+    """Apply pending migrations up to target. Returns the versions applied."""
+    current = schema_version(conn)
+    if current >= target:
+        return []
+
+    applied = []
+    for version, step in MIGRATIONS:
+        if current < version <= target:
+            step(conn)
+            conn.commit()
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+            applied.append(version)
+    return applied
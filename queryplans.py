@@ -0,0 +1,228 @@
+"""EXPLAIN QUERY PLAN checks for the SQL in the app's modules (SOURCES).
+
+Statements are read straight from the source (every string passed to
+execute()/executemany()), so a new query is checked without registering
+it anywhere. f-strings are rendered with SAMPLE_VALUES standing in for
+their runtime pieces. A plan step that scans a whole table or index fails
+the check unless ALLOWED_SCANS lists that exact statement in that function.
+"""
+import ast
+import os
+import sqlite3
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCES = ("app.py", "Auth.py", "Search.py", "votes.py", "scheduler.py",
+           "maintenance.py", "state.py", "bulk.py", "bench.py")
+
+# stand-ins for the interpolated parts of f-string SQL, per source file,
+# keyed by the expression as written in the f-string
+SAMPLE_VALUES = {
+    "app.py": {
+        "marks": "?,?",
+        "where": "WHERE p.id < ?",
+    },
+    "Search.py": {
+        "marks": "?,?",
+        "name": "posts_fts",
+        "where": "p.id < ? AND ",
+        "_HL_START": "[",
+        "_HL_END": "]",
+        "SNIPPET_TOKENS": "16",
+        "_FTS_RANK": "bm25(posts_fts, 10.0, 1.0)",
+        "_HEADING_CAPTION": "CASE WHEN instr(caption, '#') THEN caption END",
+        "keyset": "AND (bm25(posts_fts, 10.0, 1.0) > ?"
+                  " OR (bm25(posts_fts, 10.0, 1.0) = ? AND p.id < ?))",
+        "','.join('?' * len(page))": "?,?",
+    },
+    "votes.py": {
+        "marks": "?,?",
+    },
+    "scheduler.py": {
+        "marks": "?,?",
+        "','.join('?' * len(kinds))": "?,?",
+    },
+    "maintenance.py": {
+        "marks": "?,?",
+        "table": "comments",
+        "mode": "PASSIVE",
+    },
+    "state.py": {
+        "marks": "?,?",
+    },
+    "bulk.py": {
+        "marks": "?,?",
+        "table": "posts",
+        "', '.join(columns)": "id, title",
+        "', '.join(keys)": "id, title",
+        "', '.join('?' * len(keys))": "?, ?",
+        "select": "id + 0, title",
+        "key": "id",
+        "name": "trg_post_changes_insert",
+        "fts": "posts_fts",
+        "IMPORT_CACHE_KIB": "65536",
+        "cache_size": "-2000",
+    },
+    "bench.py": {
+        "column": "up",
+    },
+}
+
+# statements allowed to scan, keyed on (file, enclosing function, SQL with
+# whitespace collapsed), with the reason. Entries must match exactly: an
+# edit to an allowed statement has to be reviewed again here.
+ALLOWED_SCANS = {
+    ("app.py", "_attachments_by_post",
+     "SELECT id, post_id, filename, path FROM attachments ORDER BY post_id, id ASC"):
+        "full feed: reads every attachment",
+    ("app.py", "load_test_command", "SELECT id FROM posts ORDER BY id DESC LIMIT ?"):
+        "newest rows off the rowid end; stops at LIMIT",
+    ("app.py", "load_test_command", "SELECT COUNT(*) FROM posts"):
+        "load-test report: dataset size, once per run",
+    ("app.py", "load_test_command", "SELECT COUNT(*) FROM comments"):
+        "load-test report: dataset size, once per run",
+    ("bench.py", "bench_votes_command", "SELECT id FROM posts ORDER BY id DESC LIMIT ?"):
+        "newest rows off the rowid end; stops at LIMIT",
+    ("Search.py", "sync_search_indexes", "SELECT id, title FROM posts"):
+        "search index build: at startup or after falling behind",
+    ("Search.py", "sync_search_indexes",
+     "SELECT id, title, CASE WHEN instr(caption, '#') THEN caption END FROM posts"):
+        "search index build: at startup or after falling behind",
+    ("Search.py", "load_term_trie",
+     "SELECT term, COUNT(*) FROM post_terms GROUP BY term HAVING COUNT(*) >= ?"):
+        "suggestion trie build: at startup and every TERM_TRIE_RELOAD_CHANGES changes",
+    ("Search.py", "_trigger_exists", "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name=?"):
+        "schema lookup",
+    ("Search.py", "_table_exists", "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?"):
+        "schema lookup",
+    ("scheduler.py", "_reload",
+     "SELECT run_at, id FROM scheduled_jobs WHERE kind IN (?,?) ORDER BY run_at LIMIT ?"):
+        "earliest deadlines off the run_at index; stops at LIMIT",
+    ("maintenance.py", "backup", "SELECT 1 FROM sqlite_master LIMIT 1"):
+        "schema lookup",
+    ("bulk.py", "export_jsonl", "SELECT id, title FROM posts ORDER BY id"):
+        "JSONL export: reads every row",
+    ("bulk.py", "_deferred_triggers",
+     "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND sql IS NOT NULL AND tbl_name IN (?,?)"):
+        "schema lookup",
+    ("bulk.py", "_create_stage", "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?"):
+        "schema lookup",
+    ("bulk.py", "_publish", "SELECT 1 FROM sqlite_master WHERE name = ?"):
+        "schema lookup",
+    ("bulk.py", "_reserve_ids", "SELECT seq FROM main.sqlite_sequence WHERE name = ?"):
+        "one row per AUTOINCREMENT table",
+    ("bulk.py", "_reserve_ids", "UPDATE main.sqlite_sequence SET seq = ? WHERE name = ?"):
+        "one row per AUTOINCREMENT table",
+}
+
+# temp tables that only exist while their code runs; statements using
+# them cannot be planned here and are skipped
+TEMP_TABLES = {
+    "import_terms": "bulk.py: per-import staging table for post terms",
+    "import_posts": "bulk.py: per-import staging table",
+    "import_comments": "bulk.py: per-import staging table",
+    "import_attachments": "bulk.py: per-import staging table",
+}
+
+SQL_VERBS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def _render(node, samples):
+    """SQL text of a string or f-string argument, or None if not static."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if not isinstance(node, ast.JoinedStr):
+        return None
+    parts = []
+    for value in node.values:
+        if isinstance(value, ast.Constant):
+            parts.append(value.value)
+            continue
+        expr = ast.unparse(value.value)
+        if expr not in samples:
+            return None
+        parts.append(samples[expr])
+    return "".join(parts)
+
+
+def _calls(node, function):
+    """(enclosing function name, Call node) for every call under node."""
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            yield from _calls(child, child.name)
+            continue
+        if isinstance(child, ast.Call):
+            yield function, child
+        yield from _calls(child, function)
+
+
+def statements(filename):
+    """(line, function, sql) for each SQL statement passed to execute() in filename.
+
+    function is the name of the innermost def around the call ("<module>"
+    at top level). f-strings with an expression missing from SAMPLE_VALUES
+    come back with sql None, so they are reported instead of silently
+    skipped.
+    """
+    with open(os.path.join(BASE_DIR, filename)) as f:
+        tree = ast.parse(f.read(), filename)
+    samples = SAMPLE_VALUES.get(filename, {})
+    for function, node in _calls(tree, "<module>"):
+        if not (node.args and getattr(node.func, "attr", None) in ("execute", "executemany")):
+            continue
+        arg = node.args[0]
+        if not isinstance(arg, (ast.Constant, ast.JoinedStr)):
+            continue    # DDL passed by name
+        sql = _render(arg, samples)
+        if sql is not None and not sql.lstrip().upper().startswith(SQL_VERBS):
+            continue    # PRAGMAs
+        yield node.lineno, function, sql
+
+
+def explain(db, sql):
+    """Plan step details for sql, with every parameter bound to NULL."""
+    rows = db.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count("?")).fetchall()
+    return [r[3] for r in rows]
+
+
+def full_scans(plan):
+    """Plan steps that read a whole table or index (FTS lookups excluded)."""
+    return [step for step in plan
+            if step.startswith("SCAN ") and "VIRTUAL TABLE" not in step]
+
+
+def check_query_plans(db, sources=SOURCES):
+    """Explain every statement in sources.
+
+    Returns (checked, problems): problems are (where, sql, detail) for
+    statements that scan without an ALLOWED_SCANS entry, cannot be
+    planned against this schema, or could not be rendered, and for
+    ALLOWED_SCANS entries (in sources) that match no statement.
+    """
+    checked = 0
+    problems = []
+    seen = set()
+    for filename in sources:
+        for line, function, sql in statements(filename):
+            where = f"{filename}:{line}"
+            if sql is None:
+                problems.append((where, None, "f-string needs SAMPLE_VALUES"))
+                continue
+            flat = " ".join(sql.split())
+            key = (filename, function, flat)
+            seen.add(key)
+            if any(f" {table} " in f" {flat} " for table in TEMP_TABLES):
+                continue
+            try:
+                plan = explain(db, sql)
+            except sqlite3.Error as e:
+                problems.append((where, flat, f"cannot plan: {e}"))
+                continue
+            checked += 1
+            scans = full_scans(plan)
+            if scans and key not in ALLOWED_SCANS:
+                problems.append((f"{where} ({function})", flat, "; ".join(scans)))
+    for key in ALLOWED_SCANS:
+        if key[0] in sources and key not in seen:
+            problems.append((f"{key[0]} ({key[1]})", key[2],
+                             "ALLOWED_SCANS entry matches no statement"))
+    return checked, problems
@@ -0,0 +1,206 @@
+import heapq
+import os
+import sqlite3
+import threading
+import time
+
+from db import connect, writer
+
+SCHEDULER_BATCH = 100         # due jobs claimed per writer transaction
+SCHEDULER_POLL = 15           # seconds between table re-reads (jobs from other workers)
+SCHEDULER_RETRY_DELAY = 30    # seconds before a failed job is tried again
+
+
+class Scheduler:
+    """Durable delayed jobs: rows in scheduled_jobs, run by one thread per process.
+
+    A job is (kind, target_id, run_at); a kind may be scheduled at most once
+    per target. The thread sleeps until the earliest deadline in its heap,
+    then claims every due row in one writer transaction and runs the kind's
+    handler on all of them together, in that same transaction. Because the
+    rows live in the database, any worker can cancel a job, jobs survive a
+    restart, and whichever worker claims a due row first is the only one to
+    run it. The heap is refilled from the table every SCHEDULER_POLL
+    seconds, so jobs scheduled by a worker that has since exited still run.
+
+    Handlers are registered with register(kind, job, after): job(conn, ids)
+    runs inside the claiming transaction, and after(result) runs on the
+    scheduler thread once it has committed (for in-memory bookkeeping).
+    Rows of kinds this process has no handler for (registered by another
+    version of the app) are neither loaded nor claimed, so they cannot
+    crowd out the kinds it does handle.
+    """
+
+    def __init__(self, db_writer=writer, path=None, poll=SCHEDULER_POLL,
+                 batch_size=SCHEDULER_BATCH):
+        self.writer = db_writer
+        self.path = path
+        self.poll = poll
+        self.batch_size = batch_size
+        self.handlers = {}
+        self.runs = 0
+        self._heap = []           # (run_at, job id); cancelled jobs linger until popped
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def register(self, kind, job, after=None):
+        self.handlers[kind] = (job, after)
+
+    def start(self):
+        """Start this process's scheduler thread if it is not running (cheap).
+
+        Returns True only for the call that started it.
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            return False
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return False
+            self._pid = os.getpid()
+            self._heap = []
+            self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+            self._thread.start()
+            return True
+
+    def schedule(self, kind, target_id, delay):
+        """Run kind on target_id in delay seconds.
+
+        Returns False if that job is already pending (nothing is changed).
+        """
+        if kind not in self.handlers:
+            raise KeyError(f"no handler registered for {kind!r}")
+        run_at = time.time() + delay
+
+        def insert_job(conn):
+            cur = conn.execute(
+                """INSERT INTO scheduled_jobs (kind, target_id, run_at) VALUES (?, ?, ?)
+                   ON CONFLICT (kind, target_id) DO NOTHING""",
+                (kind, target_id, run_at)
+            )
+            return cur.lastrowid if cur.rowcount else None
+
+        job_id = self.writer.run(insert_job)
+        if job_id is None:
+            return False
+        self.start()
+        with self._lock:
+            heapq.heappush(self._heap, (run_at, job_id))
+        self._wake.set()
+        return True
+
+    def cancel(self, kind, target_id):
+        """Drop a pending job. Returns False if it already ran or never existed."""
+        def delete_job(conn):
+            return conn.execute(
+                "DELETE FROM scheduled_jobs WHERE kind = ? AND target_id = ?",
+                (kind, target_id)
+            ).rowcount
+
+        return self.writer.run(delete_job) > 0
+
+    def pending(self, kind, target_id):
+        row = connect(self.path, readonly=True).execute(
+            "SELECT 1 FROM scheduled_jobs WHERE kind = ? AND target_id = ?",
+            (kind, target_id)
+        ).fetchone()
+        return row is not None
+
+    def _reload(self):
+        """Refill the heap from the table (new process, or other workers' jobs)."""
+        kinds = list(self.handlers)
+        marks = ",".join("?" * len(kinds))
+        try:
+            rows = connect(self.path, readonly=True).execute(
+                f"SELECT run_at, id FROM scheduled_jobs WHERE kind IN ({marks}) ORDER BY run_at LIMIT ?",
+                kinds + [self.batch_size]
+            ).fetchall()
+        except sqlite3.OperationalError:
+            rows = []    # table not migrated yet
+        with self._lock:
+            # merge: a job pushed by schedule() may postdate the SELECT
+            self._heap = list(set(self._heap).union(tuple(r) for r in rows))
+            heapq.heapify(self._heap)
+
+    def _claim_and_run(self, conn, now):
+        """Writer job: claim due rows, run each kind's handler on its targets."""
+        kinds = list(self.handlers)
+        rows = conn.execute(
+            f"""SELECT id, kind, target_id FROM scheduled_jobs
+                WHERE run_at <= ? AND kind IN ({",".join("?" * len(kinds))})
+                ORDER BY run_at LIMIT ?""",
+            [now] + kinds + [self.batch_size]
+        ).fetchall()
+        by_kind = {}
+        for job_id, kind, target_id in rows:
+            by_kind.setdefault(kind, []).append((job_id, target_id))
+
+        handled = 0
+        done = []
+        for kind, jobs in by_kind.items():
+            job_ids = [j for j, _ in jobs]
+            marks = ",".join("?" * len(job_ids))
+            handled += len(jobs)
+            conn.execute("SAVEPOINT kind")
+            try:
+                result = self.handlers[kind][0](conn, [t for _, t in jobs])
+            except Exception:
+                conn.execute("ROLLBACK TO kind")
+                conn.execute("RELEASE kind")
+                conn.execute(
+                    f"UPDATE scheduled_jobs SET run_at = ? WHERE id IN ({marks})",
+                    [now + SCHEDULER_RETRY_DELAY] + job_ids
+                )
+                continue
+            conn.execute(f"DELETE FROM scheduled_jobs WHERE id IN ({marks})", job_ids)
+            conn.execute("RELEASE kind")
+            done.append((kind, result))
+        return len(rows), handled, done
+
+    def run_due(self):
+        """Run every job that is due now, in batches. Returns how many were claimed."""
+        claimed = 0
+        while True:
+            count, handled, done = self.writer.run(self._claim_and_run, time.time())
+            self.runs += handled
+            claimed += handled
+            for kind, result in done:
+                after = self.handlers[kind][1]
+                if after is not None:
+                    try:
+                        after(result)
+                    except Exception:
+                        pass    # the jobs themselves have committed
+            if count < self.batch_size or not handled:
+                return claimed
+
+    def _loop(self):
+        self._reload()
+        next_reload = time.monotonic() + self.poll
+        while True:
+            with self._lock:
+                deadline = self._heap[0][0] if self._heap else None
+            timeout = next_reload - time.monotonic()
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.time())
+            if timeout > 0:
+                self._wake.wait(timeout)
+                self._wake.clear()
+
+            now = time.time()
+            with self._lock:
+                due = bool(self._heap) and self._heap[0][0] <= now
+                while self._heap and self._heap[0][0] <= now:
+                    heapq.heappop(self._heap)
+            if due:
+                try:
+                    self.run_due()
+                except Exception:
+                    pass    # rows are still in the table; the next reload retries them
+            if time.monotonic() >= next_reload:
+                self._reload()
+                next_reload = time.monotonic() + self.poll
+
+
+scheduler = Scheduler()
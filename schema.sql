@@ -13,6 +13,8 @@ CREATE TABLE IF NOT EXISTS posts (
     user_id INTEGER,
     title TEXT NOT NULL,
     caption TEXT NOT NULL,
+    caption_html TEXT,
+    caption_hash TEXT,
     post_type TEXT NOT NULL DEFAULT 'text',
     up INTEGER NOT NULL DEFAULT 0,
     down INTEGER NOT NULL DEFAULT 0,
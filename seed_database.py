@@ -1,11 +1,12 @@
-import sqlite3
 import os
+from db import connect
+from Search import backfill_post_terms
 from werkzeug.security import generate_password_hash
 from datetime import datetime, timedelta
 
 def create_admin_user(db_path='feed.db'):
     """Create an admin user if one doesn't exist."""
-    conn = sqlite3.connect(db_path)
+    conn = connect(db_path)
     cursor = conn.cursor()
     
     # Check if admin exists
@@ -29,7 +30,6 @@ def create_admin_user(db_path='feed.db'):
         admin_id = admin[0]
         print(f"Admin user already exists with ID: {admin_id}")
     
-    conn.close()
     return admin_id
 
 def create_posts(admin_id, db_path='feed.db'):
@@ -1000,7 +1000,7 @@ Input Size (n) | O(1) | O(log n) | O(n) | O(n log n) | O(n²)
         }
     ]
     
-    conn = sqlite3.connect(db_path)
+    conn = connect(db_path)
     cursor = conn.cursor()
     
     # Create posts table if it doesn't exist
@@ -1037,12 +1037,13 @@ Input Size (n) | O(1) | O(log n) | O(n) | O(n log n) | O(n²)
         ''', (admin_id, post['title'], post['caption'], post['post_type'], up, down, created_at))
     
     conn.commit()
-    conn.close()
+    # index their terms as the app does on create (related counts, suggestions)
+    backfill_post_terms(conn)
     print(f"Created {len(posts)} educational posts")
 
 if __name__ == "__main__":
     # Initialize database if it doesn't exist
-    from app import init_db
+    from app import init_db, backfill_captions
     init_db()
     
     # Create admin user and get their ID
@@ -1050,5 +1051,8 @@ if __name__ == "__main__":
     
     # Create educational posts
     create_posts(admin_id)
+
+    # Pre-render captions so page views never run Markdown
+    backfill_captions()
     
     print("Database seeding completed successfully!")
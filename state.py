@@ -0,0 +1,184 @@
+"""Shared state for the interactive demos (queue, stack, trees, graph).
+
+The demo routes keep their data in module globals. Decorating a route
+with @shared_state("queue", ...) makes those globals shared by every
+worker process: before the view runs, the named globals are refreshed
+from the state store, and afterwards the ones it changed are written
+back. Each global is one row, stored as a zlib-compressed pickle with a
+version number. A save fails if any named global moved on since the load,
+and the view is then re-run on fresh state (optimistic concurrency), so
+two workers never overwrite each other's changes. Within a process, a
+demo request holds a lock per global it names (taken in name order), so
+requests on different globals run side by side. Views declared
+readonly=True load the globals but skip the save.
+
+DEMO_STATE_BACKEND picks the store: "sqlite" (the demo_state table) or
+"memory" (the old per-process globals, for a single worker).
+"""
+import os
+import pickle
+import threading
+import zlib
+from contextlib import ExitStack
+from functools import wraps
+
+from flask import jsonify
+
+from db import connect, run_write
+
+DEMO_STATE_BACKEND = os.environ.get("DEMO_STATE_BACKEND", "sqlite")
+STATE_RETRIES = 5
+
+
+def _assign(namespace, name, value):
+    """Set a global, in place for lists and dicts: other modules that
+    star-imported the same object (the SVG renderers) see the new contents."""
+    current = namespace.get(name)
+    if isinstance(current, list) and isinstance(value, list):
+        current[:] = value
+    elif isinstance(current, dict) and isinstance(value, dict):
+        current.clear()
+        current.update(value)
+    else:
+        namespace[name] = value
+
+
+def _empty(value):
+    if isinstance(value, list):
+        return []
+    if isinstance(value, dict):
+        return {}
+    return None
+
+
+class MemoryStateStore:
+    """The globals themselves are the state: correct with one worker only."""
+
+    def load(self, namespace, names):
+        return None
+
+    def save(self, namespace, names, loaded):
+        return True
+
+    def forget(self, names):
+        pass
+
+
+class SQLiteStateStore:
+    """Demo globals in the demo_state table, one versioned row per name.
+
+    The rows only hold data the demos create, so unpickling them is as
+    trusted as the rest of feed.db.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._cache = {}    # name -> (version, pickle) matching this process's global
+
+    def load(self, namespace, names):
+        """Bring the named globals up to date. Returns the versions read."""
+        db = connect(self.path, readonly=True)
+        marks = ",".join("?" * len(names))
+        versions = dict(db.execute(
+            f"SELECT name, version FROM demo_state WHERE name IN ({marks})", names).fetchall())
+        stale = [n for n in names
+                 if versions.get(n, 0) != self._cache.get(n, (None,))[0]]
+        if stale:
+            marks = ",".join("?" * len(stale))
+            rows = db.execute(
+                f"SELECT name, version, data FROM demo_state WHERE name IN ({marks})", stale)
+            fetched = {name: (version, zlib.decompress(data)) for name, version, data in rows}
+            for name in stale:
+                if name in fetched:
+                    version, raw = fetched[name]
+                    _assign(namespace, name, pickle.loads(raw))
+                else:
+                    version = 0
+                    _assign(namespace, name, _empty(namespace.get(name)))
+                    raw = pickle.dumps(namespace.get(name), pickle.HIGHEST_PROTOCOL)
+                self._cache[name] = (version, raw)
+                versions[name] = version
+        return {n: versions.get(n, 0) for n in names}
+
+    def save(self, namespace, names, loaded):
+        """Write the globals the view changed. False if another worker got there first."""
+        changed = {}
+        for name in names:
+            raw = pickle.dumps(namespace.get(name), pickle.HIGHEST_PROTOCOL)
+            if raw != self._cache[name][1]:
+                changed[name] = raw
+        if not changed:
+            return True
+
+        def store(conn):
+            for name in names:
+                row = conn.execute("SELECT version FROM demo_state WHERE name = ?", (name,)).fetchone()
+                if (row[0] if row else 0) != loaded[name]:
+                    return False
+            conn.executemany(
+                """INSERT INTO demo_state (name, version, data) VALUES (?, 1, ?)
+                   ON CONFLICT (name) DO UPDATE SET version = version + 1, data = excluded.data,
+                                                    updated_at = CURRENT_TIMESTAMP""",
+                [(name, zlib.compress(raw)) for name, raw in changed.items()]
+            )
+            return True
+
+        if not run_write(store):
+            return False
+        for name, raw in changed.items():
+            self._cache[name] = (loaded[name] + 1, raw)
+        return True
+
+    def forget(self, names):
+        """Drop cached versions, so the next load re-reads these globals."""
+        for name in names:
+            self._cache.pop(name, None)
+
+
+def make_store(backend=DEMO_STATE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteStateStore()
+    if backend == "memory":
+        return MemoryStateStore()
+    raise ValueError(f"unknown DEMO_STATE_BACKEND {backend!r}")
+
+
+demo_state = make_store()
+_locks = {}                         # global name -> RLock
+_locks_guard = threading.Lock()
+
+
+def _state_locks(names):
+    """The locks for names, in the one order every view takes them."""
+    with _locks_guard:
+        return [_locks.setdefault(name, threading.RLock()) for name in sorted(set(names))]
+
+
+def shared_state(*names, readonly=False):
+    """Route decorator: run the view against the shared values of these globals.
+
+    A readonly view must not change them; it is neither saved nor retried.
+    """
+    def decorator(view):
+        namespace = view.__globals__
+        locks = _state_locks(names)
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with ExitStack() as held:
+                for lock in locks:
+                    held.enter_context(lock)
+                for _ in range(STATE_RETRIES):
+                    loaded = demo_state.load(namespace, names)
+                    try:
+                        response = view(*args, **kwargs)
+                        saved = readonly or demo_state.save(namespace, names, loaded)
+                    except Exception:
+                        demo_state.forget(names)
+                        raise
+                    if saved:
+                        return response
+                    demo_state.forget(names)
+            return jsonify({"ok": False, "error": "state_conflict"}), 409
+        return wrapper
+    return decorator
@@ -0,0 +1,32 @@
+"""Fixtures: a migrated scratch database that the app modules default to."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from bulk import import_jsonl
+from loadtest import synthetic_records
+from migrations import migrate
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Path of a fresh, fully migrated database; connect() and run_write() use it."""
+    path = str(tmp_path / "feed.db")
+    monkeypatch.setattr(db, "DATABASE", path)
+    monkeypatch.setattr(db, "writer", db.Writer(path))
+    migrate(db.connect(path))
+    yield path
+    db.pool.close_thread()
+
+
+@pytest.fixture
+def seed_posts(db_path):
+    """seed_posts(n, **options): add n synthetic posts (see loadtest.synthetic_records)."""
+    def seed(posts, **options):
+        options.setdefault("caption_words", 20)
+        return import_jsonl(db.connect(db_path), synthetic_records(posts, **options))
+    return seed
@@ -0,0 +1,42 @@
+import bulk
+from db import connect
+
+
+def test_import_reports_phases_and_restores_fts_merging(db_path, seed_posts):
+    rows = seed_posts(200)
+    assert bulk.last_import["rows"] == rows
+    assert bulk.last_import["stage_seconds"] >= 0 and bulk.last_import["publish_seconds"] > 0
+
+    db = connect(db_path, readonly=True)
+    for fts in bulk.FTS_TABLES:
+        assert db.execute(f"SELECT v FROM {fts}_config WHERE k = 'automerge'").fetchone()[0] \
+            == bulk.FTS_AUTOMERGE
+        assert db.execute(f"SELECT COUNT(*) FROM {fts} WHERE {fts} MATCH 'queue'").fetchone()[0] > 0
+
+
+def test_app_writes_between_batches_get_ids_after_the_import(db_path, seed_posts, monkeypatch):
+    seed_posts(10, seed=1)
+    monkeypatch.setattr(bulk, "IMPORT_COMMIT_POSTS", 25)
+    publish = bulk._publish
+    written = []
+
+    def publish_then_write(conn, *args):
+        publish(conn, *args)
+        # the app, between two of the import's transactions
+        other = connect(db_path)
+        written.append(other.execute(
+            "INSERT INTO posts (title, caption) VALUES ('Mine', '') RETURNING id").fetchone()[0])
+        other.commit()
+
+    monkeypatch.setattr(bulk, "_publish", publish_then_write)
+    seed_posts(100, seed=2)
+
+    db = connect(db_path, readonly=True)
+    assert len(written) == 4 and min(written) > 110
+    imported = db.execute("SELECT COUNT(*), MIN(id), MAX(id) FROM posts WHERE id < ?",
+                          (min(written),)).fetchone()
+    assert tuple(imported) == (110, 1, 110)
+    comments = dict(db.execute("SELECT post_id, COUNT(*) FROM comments GROUP BY post_id"))
+    assert all(count == comments.get(pid, 0) for pid, count in
+               db.execute("SELECT post_id, comment_count FROM post_stats"))
+    assert db.execute("SELECT COUNT(*) FROM post_stats").fetchone()[0] == 114
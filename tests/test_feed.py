@@ -0,0 +1,61 @@
+from app import _attachments_by_post, _feed_post, app
+from db import connect, get_db
+from StackQueue import Stack
+
+
+def get_feed_stack():
+    """The whole feed, newest first, the way the feed page once loaded it."""
+    db = get_db()
+
+    rows = db.execute("""
+        SELECT p.*, u.username,
+               s.latest_comment,
+               s.latest_comment_at AS latest_comment_time,
+               s.comment_count, s.attachment_count
+        FROM posts p
+        LEFT JOIN users u ON p.user_id = u.id
+        LEFT JOIN post_stats s ON s.post_id = p.id
+        ORDER BY p.id DESC
+    """).fetchall()
+
+    has_attachments = any(r["attachment_count"] for r in rows)
+    attachments = _attachments_by_post(db) if has_attachments else {}
+
+    stack = Stack()
+    for r in rows:
+        stack.push(_feed_post(r, attachments))
+
+    return stack.to_list()
+
+
+def traced_feed():
+    """get_feed_stack() and the SQL statements it ran."""
+    statements = []
+    with app.app_context():
+        conn = get_db()
+        conn.set_trace_callback(statements.append)
+        try:
+            posts = get_feed_stack()
+        finally:
+            conn.set_trace_callback(None)
+    return posts, statements
+
+
+def test_feed_stack_query_count_does_not_grow(db_path, seed_posts):
+    seed_posts(50, seed=1)
+    conn = connect(db_path)
+    conn.execute("INSERT INTO attachments (post_id, filename, path) VALUES (1, 'a.png', 'a.png')")
+    conn.commit()
+    small, small_statements = traced_feed()
+
+    seed_posts(4950, seed=2)
+    posts, statements = traced_feed()
+
+    assert len(small) == 50 and len(posts) == 5000
+    # posts with their stats, then attachments: two queries at any size
+    assert len(statements) == len(small_statements) == 2
+
+    comments = dict(conn.execute("SELECT post_id, COUNT(*) FROM comments GROUP BY post_id"))
+    by_id = {p["id"]: p for p in posts}
+    assert all(p["comment_count"] == comments.get(pid, 0) for pid, p in by_id.items())
+    assert [a["filename"] for a in by_id[1]["attachments"]] == ["a.png"]
@@ -0,0 +1,26 @@
+from loadtest import run_load
+
+
+class FakeDriver:
+    """Answers every route with a fixed (status, X-Cache) pair."""
+
+    def __init__(self, answers):
+        self.answers = answers
+
+    def session(self):
+        def send(method, path, body=None):
+            route = "home" if path == "/" else "search"
+            return self.answers[route]
+        return send
+
+
+def test_only_2xx_succeeds_and_cache_hits_are_reported():
+    driver = FakeDriver({"home": (302, None), "search": (200, "hit")})
+    report = run_load(driver, [1], requests=40, concurrency=2, mix={"home": 1, "search": 1})
+    routes = report["routes"]
+
+    assert routes["home"]["errors"] == routes["home"]["requests"] > 0
+    assert routes["home"]["cache_hit_share"] is None
+    assert routes["search"]["errors"] == 0
+    assert routes["search"]["cache_hit_share"] == 1.0
+    assert routes["all"]["requests"] == 40
@@ -0,0 +1,41 @@
+import sqlite3
+import threading
+
+from maintenance import _off_thread, convert_auto_vacuum
+
+
+def auto_vacuum(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_auto_vacuum_conversion_is_opt_in(db_path):
+    assert auto_vacuum(db_path) == 0    # migrate() leaves it alone
+
+    assert convert_auto_vacuum(db_path) is True
+    assert auto_vacuum(db_path) == 2
+    assert convert_auto_vacuum(db_path) is False
+
+
+def test_scheduled_work_runs_off_the_scheduler_thread():
+    release, done = threading.Event(), threading.Event()
+    ran, rescheduled = [], []
+
+    def work():
+        ran.append(threading.current_thread().name)
+        release.wait(5)
+
+    def reschedule():
+        rescheduled.append(True)
+        done.set()
+
+    after = _off_thread("maintenance", work, reschedule)
+    after(None)         # returns while work() is still blocked
+    after(None)         # overlapping run is skipped
+    assert not rescheduled
+    release.set()
+    assert done.wait(5)
+    assert ran == ["maintenance"] and rescheduled == [True]
@@ -0,0 +1,18 @@
+from db import connect, run_write
+from migrations import backfill_caption_html
+
+
+def test_caption_backfill_renders_missing_html(db_path):
+    def add(conn):
+        conn.executemany("INSERT INTO posts (title, caption) VALUES (?, ?)",
+                         [(f"post {i}", f"# Heading {i}\n\n**bold** <script>x</script>")
+                          for i in range(3)])
+    run_write(add)
+
+    conn = connect(db_path)
+    backfill_caption_html(conn)
+    rows = conn.execute("SELECT caption_html, caption_hash FROM posts ORDER BY id").fetchall()
+    assert len(rows) == 3
+    for i, (html, digest) in enumerate(rows):
+        assert html.startswith(f"<h1>Heading {i}</h1>") and "<strong>bold</strong>" in html
+        assert "<script>" not in html and digest
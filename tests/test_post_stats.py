@@ -0,0 +1,14 @@
+from db import connect
+
+
+def test_out_of_order_comment_still_counts(db_path):
+    conn = connect(db_path)
+    conn.execute("INSERT INTO posts (id, title, caption) VALUES (1, 'Queue', 'FIFO')")
+    conn.execute("INSERT INTO comments (id, post_id, comment) VALUES (10, 1, 'newer')")
+    # a lower id arriving later, as from an import or a restore
+    conn.execute("INSERT INTO comments (id, post_id, comment) VALUES (5, 1, 'older')")
+    conn.commit()
+
+    row = conn.execute("""SELECT comment_count, latest_comment_id, latest_comment
+                          FROM post_stats WHERE post_id = 1""").fetchone()
+    assert tuple(row) == (2, 10, "newer")
@@ -0,0 +1,22 @@
+from db import connect
+from queryplans import ALLOWED_SCANS, check_query_plans
+
+
+def test_every_statement_plans_without_unreviewed_scans(db_path):
+    checked, problems = check_query_plans(connect(db_path, readonly=True))
+    assert problems == []
+    assert checked > 0
+
+
+def test_allowlist_is_keyed_on_the_exact_statement(db_path, monkeypatch):
+    (filename, function, sql), reason = next(iter(ALLOWED_SCANS.items()))
+    edited = dict(ALLOWED_SCANS)
+    del edited[(filename, function, sql)]
+    edited[(filename, function, sql + " LIMIT 10")] = reason
+    monkeypatch.setattr("queryplans.ALLOWED_SCANS", edited)
+
+    _, problems = check_query_plans(connect(db_path, readonly=True))
+    scans = [detail for _, flat, detail in problems if flat == sql]
+    assert scans and all(detail.startswith("SCAN ") for detail in scans)
+    assert [p for p in problems if p[2] == "ALLOWED_SCANS entry matches no statement"] == [
+        (f"{filename} ({function})", sql + " LIMIT 10", "ALLOWED_SCANS entry matches no statement")]
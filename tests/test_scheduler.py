@@ -0,0 +1,22 @@
+import db
+from db import connect
+from scheduler import Scheduler
+
+
+def test_unknown_kinds_do_not_starve_registered_ones(db_path):
+    conn = connect(db_path)
+    # due earlier than anything this version handles
+    conn.executemany("INSERT INTO scheduled_jobs (kind, target_id, run_at) VALUES ('retired', ?, ?)",
+                     [(i, i) for i in range(10)])
+    conn.execute("INSERT INTO scheduled_jobs (kind, target_id, run_at) VALUES ('publish', 7, 100)")
+    conn.commit()
+
+    ran = []
+    scheduler = Scheduler(db.writer, db_path, batch_size=4)
+    scheduler.register("publish", lambda conn, ids: ran.extend(ids))
+    scheduler._reload()
+
+    assert [job_id for _, job_id in scheduler._heap] == [11]
+    assert scheduler.run_due() == 1
+    assert ran == [7]
+    assert conn.execute("SELECT COUNT(*) FROM scheduled_jobs WHERE kind = 'retired'").fetchone()[0] == 10
@@ -0,0 +1,128 @@
+import random
+
+import pytest
+
+import Search
+from db import connect, run_write
+from Search import (SEARCH_MAX_LIMIT, cached_search_rows, has_trigram, index_post_terms,
+                    search_post_rows, suggest)
+
+QUERIES = [
+    "", "a", "e", "qu", "ue", "ueu", "Queue", "QUEUE", "tack", "dijkstra", "ee",
+    "heap ", "ch tr", "sor", "binary search", "zzzz", "%", "_a", 'qu"e', "list",
+]
+
+
+def paged_ids(db, q, mode="substring", limit=SEARCH_MAX_LIMIT):
+    """Every id a search mode returns for q, following its cursors."""
+    ids, cursor = [], None
+    while True:
+        rows, cursor = search_post_rows(db, q, limit, mode, cursor)
+        ids.extend(r["id"] for r in rows)
+        if cursor is None:
+            return ids
+
+
+@pytest.mark.parametrize("q", QUERIES)
+def test_trigram_search_matches_like(db_path, seed_posts, q):
+    seed_posts(400, caption_words=15, seed=9)
+    db = connect(db_path, readonly=True)
+    assert has_trigram(db)
+
+    expected = [r[0] for r in db.execute(
+        "SELECT id FROM posts WHERE title LIKE ? OR caption LIKE ? ORDER BY id DESC",
+        (f"%{q}%", f"%{q}%"))]
+    assert paged_ids(db, q) == expected
+
+
+@pytest.mark.parametrize("q", ["heap", "tree sort", "q"])
+def test_fts_cursor_pages_through_ranked_results(db_path, seed_posts, q):
+    seed_posts(300, seed=4)
+    db = connect(db_path, readonly=True)
+    expected = [r[0] for r in db.execute(
+        "SELECT rowid FROM posts_fts WHERE posts_fts MATCH ?"
+        " ORDER BY bm25(posts_fts, 10.0, 1.0), rowid DESC", (Search.fts_query(q),))]
+    assert expected
+    assert paged_ids(db, q, "fts", limit=7) == expected
+
+
+def test_cursor_from_another_mode_is_rejected(db_path, seed_posts):
+    seed_posts(60, seed=4)
+    db = connect(db_path, readonly=True)
+    _, like_cursor = search_post_rows(db, "e", 5, "substring")
+    _, fts_cursor = search_post_rows(db, "heap", 5, "fts")
+    assert like_cursor and fts_cursor
+    for mode, cursor in (("fts", like_cursor), ("substring", fts_cursor),
+                         ("fuzzy", fts_cursor), ("fts", "o20"), ("fts", "not base64!")):
+        with pytest.raises(ValueError):
+            search_post_rows(db, "heap", 5, mode, cursor)
+
+
+def test_suggest_follows_writes_from_other_workers(db_path, seed_posts, monkeypatch):
+    monkeypatch.setattr(Search, "_synced_seq", None)
+    seed_posts(50)
+    db = connect(db_path, readonly=True)
+    assert suggest(db, "zebraw") == []
+
+    # written the way another worker would: no post_saved() in this process
+    def add(conn, title):
+        pid = conn.execute(
+            "INSERT INTO posts (title, caption) VALUES (?, 'zebrawords everywhere') RETURNING id",
+            (title,)).fetchone()[0]
+        index_post_terms(conn, pid, title, "zebrawords everywhere")
+        return pid
+
+    first = run_write(add, "Zebraword trees")
+    run_write(add, "Zebraword heaps")
+    assert [(s["kind"], s["text"]) for s in suggest(db, "zebraw")] == [
+        ("title", "Zebraword heaps"), ("title", "Zebraword trees"),
+        ("term", "zebraword"), ("term", "zebrawords"),
+    ]
+
+    run_write(lambda conn: conn.execute("DELETE FROM posts WHERE id=?", (first,)))
+    assert [s["text"] for s in suggest(db, "zebraw") if s["kind"] == "title"] == ["Zebraword heaps"]
+
+
+def test_title_index_substring_matches_scan(monkeypatch):
+    monkeypatch.setattr(Search, "TITLE_MERGE_POSTS", 8)
+    rng = random.Random(3)
+    words = ["heap", "queue", "stack", "tree", "sort", "graph", "Trie", "hash"]
+    titles = {pid: " ".join(rng.choices(words, k=3)) for pid in range(1, 200)}
+    index = Search.TitleIndex()
+    index.build(titles.items())
+
+    def check():
+        for q in ["ee", "tack", "heap q", "trie", "sort graph", "x", "e"]:
+            expected = sorted((t.lower(), pid) for pid, t in titles.items() if q in t.lower())
+            assert index.search(q) == [(pid, titles[pid]) for _, pid in expected]
+
+    check()
+    for _ in range(300):
+        pid = rng.randrange(1, 260)
+        if rng.random() < 0.3:
+            titles.pop(pid, None)
+            index.remove(pid)
+        else:
+            titles[pid] = " ".join(rng.choices(words, k=rng.randint(1, 4)))
+            index.add(pid, titles[pid])
+        if rng.random() < 0.1:
+            check()
+    check()
+
+
+def test_search_cache_survives_votes_but_not_edits(db_path, seed_posts):
+    seed_posts(30, seed=2)
+    db = connect(db_path, readonly=True)
+    pid = db.execute("SELECT id FROM posts ORDER BY id LIMIT 1").fetchone()[0]
+    Search.search_cache.clear()     # entries from other tests' databases
+    assert not cached_search_rows(db, "heap")[2]
+    assert cached_search_rows(db, "heap")[2]
+
+    run_write(lambda conn: conn.execute("UPDATE posts SET up = up + 3 WHERE id=?", (pid,)))
+    assert cached_search_rows(db, "heap")[2]
+
+    run_write(lambda conn: conn.execute("UPDATE posts SET title = 'Heap retitled' WHERE id=?", (pid,)))
+    assert not cached_search_rows(db, "heap")[2]
+    run_write(lambda conn: conn.execute(
+        "INSERT INTO comments (post_id, comment) VALUES (?, 'nice')", (pid,)))
+    assert not cached_search_rows(db, "heap")[2]
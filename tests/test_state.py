@@ -0,0 +1,92 @@
+import threading
+
+import state
+from state import MemoryStateStore, SQLiteStateStore, shared_state
+
+alpha = []
+beta = []
+gamma = []
+
+
+class CountingStore(MemoryStateStore):
+    def __init__(self):
+        self.saves = 0
+
+    def save(self, namespace, names, loaded):
+        self.saves += 1
+        return True
+
+
+def test_views_on_different_globals_run_side_by_side(monkeypatch):
+    monkeypatch.setattr(state, "demo_state", CountingStore())
+    inside, release = threading.Event(), threading.Event()
+
+    @shared_state("alpha")
+    def slow_push():
+        inside.set()
+        release.wait(5)
+        alpha.append(1)
+
+    @shared_state("beta")
+    def push():
+        beta.append(1)
+        pushed.set()
+
+    pushed = threading.Event()
+    slow = threading.Thread(target=slow_push)
+    slow.start()
+    assert inside.wait(5)
+    threading.Thread(target=push).start()
+    assert pushed.wait(2)       # not queued behind slow_push
+    release.set()
+    slow.join(5)
+    assert alpha == [1] and beta == [1]
+
+
+def test_readonly_views_are_not_saved(monkeypatch):
+    store = CountingStore()
+    monkeypatch.setattr(state, "demo_state", store)
+
+    @shared_state("alpha", "beta", readonly=True)
+    def size():
+        return len(alpha) + len(beta)
+
+    @shared_state("beta", "alpha")
+    def grow():
+        alpha.append(2)
+
+    size()
+    grow()
+    assert store.saves == 1
+
+
+def test_conflicting_save_reruns_the_view_on_fresh_state(db_path, monkeypatch):
+    ours, theirs = SQLiteStateStore(db_path), SQLiteStateStore(db_path)
+    monkeypatch.setattr(state, "demo_state", ours)
+    elsewhere = {"gamma": []}       # the other worker's globals
+    runs = []
+
+    def other_worker_pushes(value):
+        loaded = theirs.load(elsewhere, ("gamma",))
+        elsewhere["gamma"].append(value)
+        assert theirs.save(elsewhere, ("gamma",), loaded)
+
+    # the plain store calls, interleaved: load, their save, our save
+    loaded = ours.load(globals(), ("gamma",))
+    other_worker_pushes("b1")
+    gamma.append("lost")
+    assert ours.save(globals(), ("gamma",), loaded) is False
+    ours.forget(("gamma",))
+
+    @shared_state("gamma")
+    def push():
+        runs.append(list(gamma))
+        if len(runs) == 1:
+            other_worker_pushes("b2")
+        gamma.append("a")
+
+    push()
+    assert runs == [["b1"], ["b1", "b2"]]
+    assert gamma == ["b1", "b2", "a"]
+    assert theirs.load(elsewhere, ("gamma",)) == {"gamma": 3}
+    assert elsewhere["gamma"] == ["b1", "b2", "a"]
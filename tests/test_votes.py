@@ -0,0 +1,24 @@
+import db
+import votes
+from db import connect, run_write
+from votes import VoteAccumulator
+
+
+def test_counts_from_other_workers_show_up_after_a_while(db_path, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(votes.time, "monotonic", lambda: clock[0])
+    conn = connect(db_path)
+    conn.execute("INSERT INTO posts (id, title, caption, up, down) VALUES (1, 'Heap', '', 0, 0)")
+    conn.commit()
+    counter = VoteAccumulator(db.writer, db_path, interval=60)
+
+    assert counter.vote(1, True) == (1, 0)
+    assert counter.flush() == 1
+    # another worker's flush
+    run_write(lambda c: c.execute("UPDATE posts SET up = up + 5 WHERE id = 1"))
+
+    assert counter.vote(1, True) == (2, 0)      # remembered counts, still fresh
+    clock[0] += votes.VOTE_KNOWN_SECONDS
+    assert counter.vote(1, False) == (7, 1)
+    assert counter.flush() == 2
+    assert tuple(conn.execute("SELECT up, down FROM posts WHERE id = 1").fetchone()) == (7, 1)
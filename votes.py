@@ -0,0 +1,148 @@
+import atexit
+import os
+import threading
+import time
+
+from cache import LRUCache
+from db import connect, writer
+
+VOTE_FLUSH_INTERVAL = 0.25   # seconds between flushes
+VOTE_FLUSH_VOTES = 200       # flush early once this many votes are waiting
+VOTE_KNOWN_POSTS = 10_000    # committed counts remembered for optimistic replies
+VOTE_KNOWN_SECONDS = 2.0     # ... and for how long, since other workers vote too
+
+
+def _apply_votes(conn, deltas):
+    """Writer job: add [(post id, up, down)] deltas; return the new counts."""
+    conn.executemany(
+        "UPDATE posts SET up = up + ?, down = down + ? WHERE id = ?",
+        [(up, down, pid) for pid, up, down in deltas]
+    )
+    marks = ",".join("?" * len(deltas))
+    return conn.execute(
+        f"SELECT id, up, down FROM posts WHERE id IN ({marks})",
+        [pid for pid, _, _ in deltas]
+    ).fetchall()
+
+
+class VoteAccumulator:
+    """Write-behind vote counts: votes are summed per post in memory and
+    written in one transaction every VOTE_FLUSH_INTERVAL seconds, or as soon
+    as VOTE_FLUSH_VOTES votes are waiting.
+
+    vote() answers at once with optimistic counts: the last committed
+    counts plus everything not yet written. Committed counts are re-read
+    once they are VOTE_KNOWN_SECONDS old, so votes flushed by other
+    workers show up within that long. Pending votes are flushed at
+    interpreter exit; a hard kill loses at most one interval of votes.
+    """
+
+    def __init__(self, db_writer=writer, path=None,
+                 interval=VOTE_FLUSH_INTERVAL, max_pending=VOTE_FLUSH_VOTES):
+        self.writer = db_writer
+        self.path = path
+        self.interval = interval
+        self.max_pending = max_pending
+        self.flushes = 0
+        self.flushed_votes = 0
+        self._pending = {}      # post id -> [up, down] not yet handed to the writer
+        self._inflight = {}     # post id -> [up, down] in the flush being committed
+        self._pending_votes = 0
+        self._known = LRUCache(VOTE_KNOWN_POSTS)   # post id -> committed (up, down, read at)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @staticmethod
+    def _is_fresh(known):
+        return known is not None and time.monotonic() - known[2] < VOTE_KNOWN_SECONDS
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name="vote-flusher", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def vote(self, post_id, up):
+        """Count one vote. Returns optimistic (up, down), or None if no such post."""
+        if not self._is_fresh(self._known.get(post_id)):
+            read_at = time.monotonic()
+            row = connect(self.path, readonly=True).execute(
+                "SELECT up, down FROM posts WHERE id=?", (post_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self._lock:
+                # a flush may have stored fresher counts meanwhile
+                known = self._known.get(post_id)
+                if known is None or known[2] < read_at:
+                    self._known.set(post_id, (row[0] or 0, row[1] or 0, read_at))
+
+        with self._lock:
+            counts = self._pending.setdefault(post_id, [0, 0])
+            counts[0 if up else 1] += 1
+            self._pending_votes += 1
+            if self._pending_votes >= self.max_pending:
+                self._wake.set()
+            base = self._known.get(post_id, (0, 0, 0))
+            inflight = self._inflight.get(post_id, (0, 0))
+            result = (base[0] + inflight[0] + counts[0], base[1] + inflight[1] + counts[1])
+
+        self._ensure_started()
+        return result
+
+    def flush(self):
+        """Write all pending votes in one transaction. Returns how many."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+                votes, self._pending_votes = self._pending_votes, 0
+                self._inflight = batch
+
+            try:
+                committed = self.writer.run(
+                    _apply_votes, [(pid, up, down) for pid, (up, down) in batch.items()]
+                )
+            except Exception:
+                # keep the votes for the next flush
+                with self._lock:
+                    for pid, (up, down) in batch.items():
+                        counts = self._pending.setdefault(pid, [0, 0])
+                        counts[0] += up
+                        counts[1] += down
+                    self._pending_votes += votes
+                    self._inflight = {}
+                raise
+
+            with self._lock:
+                now = time.monotonic()
+                for pid, up, down in committed:
+                    self._known.set(pid, (up, down, now))
+                self._inflight = {}
+            self.flushes += 1
+            self.flushed_votes += votes
+            return votes
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass    # retried on the next tick
+
+    def pending(self):
+        with self._lock:
+            return self._pending_votes
+
+
+vote_counter = VoteAccumulator()